@@ -1,44 +1,199 @@
 import random
 import logging
 import math
+import heapq
+import bisect
+import time
+from array import array
 import os
-os.system("color")
+import re
 
-logging.basicConfig(
-	level=logging.INFO,
-	format="%(levelname)s %(asctime)-15s %(filename)s:%(lineno)d:%(message)s",
-	filename="output.log",
-	filemode="w"
-)
+logger = logging.getLogger(__name__)
 
 KEY_NAMES = tuple("ZYXWVUTSRQPONMLKJIHGFEDCBA")
 
+# version of the JSON and binary formats written by Graph.to_dict, GraphCore.to_bytes, and dump_graphs
+FORMAT_VERSION = 1
+BINARY_MAGIC = b"DSPN"
+# version of the graphs random_graph and example_graph produce for a given seed; bump it whenever that changes, so
+# GraphCache entries from older generators aren't reused
+GENERATOR_VERSION = 1
+
 class GraphError(Exception):
 	pass
 
+def get_rng(rng=None):
+	"""Returns a random.Random-style source of randomness for rng, which may be a random.Random, a NumPy Generator, or None
+	for the random module's shared state"""
+	if rng is None: return random
+	if hasattr(rng, "bit_generator"): return GeneratorRandom(rng)
+	return rng
+
+class GeneratorRandom(random.Random):
+	"""Adapts a NumPy Generator to the random.Random interface"""
+	def __init__(self, generator):
+		self.generator = generator
+		super().__init__()
+	
+	def random(self):
+		return float(self.generator.random())
+	
+	def getrandbits(self, k):
+		if k == 0: return 0
+		return int.from_bytes(self.generator.bytes((k + 7)//8), "little") >> (-k % 8)
+
 class Graph():
-	def __init__(self):
+	def __init__(self, rng=None):
+		# all randomness for generating, placing, laying out, and naming this graph comes from its rng, which defaults to
+		# the random module's shared state
+		self.rng = get_rng(rng)
 		self.nodes = []
 		self.links = []
 		self.keys = []
 		self.start_node = None
+		self.key_bits = {}
+		# links that can take another lock, both all together and by region, in the order they became free, along with the
+		# number of locked links; these are kept up to date as locks are added to and removed from links, unless free_links
+		# is set to None while loading a graph, in which case rebuild_link_pools needs to be called afterwards
+		self.free_links = {}
+		self.free_links_by_region = {}
+		self.locked_link_count = 0
+		self.expansion_index = None
+		self.stats = None
+		# (key item, link, node) for each key or lock placed by place_key_item or place_lock_for_key, so the most recent
+		# placements can be undone; node is None for extra locks
+		self.undo_log = []
 	
 	def __str__(self):
 		return "Graph (%s Nodes/%s Links)" % (len(self.nodes), len(self.links))
 	
 	def details(self):
-		s = "Graph:"
+		import io
+		f = io.StringIO()
+		self.write_details(f)
+		return f.getvalue()
+	
+	def write_details(self, f):
+		"""Streams the text returned by details to a text file object, one line at a time"""
+		f.write("Graph:")
 		for n in self.nodes:
-			s += "\n\t%s (Region %s)" % (n, n.region)
+			f.write("\n\t%s (Region %s)" % (n, n.region))
 			if len(n.key_items) > 0:
-				s += "\n\t\tKeys:"
+				f.write("\n\t\tKeys:")
 				for k in n.key_items:
-					s += "\n\t\t\t%s" % k
-			s += "\n\t\tLinks:"
+					f.write("\n\t\t\t%s" % k)
+			f.write("\n\t\tLinks:")
 			for l in n.links:
-				s += "\n\t\t\t%s" % l
-				if len(l.required_keys) > 0: s += " (Locked by %s)" % ", ".join([str(k) for k in l.required_keys])
-		return s
+				if len(l.required_keys) > 0:
+					f.write("\n\t\t\t%s (Locked by %s)" % (l, ", ".join([str(k) for k in l.required_keys])))
+				else:
+					f.write("\n\t\t\t%s" % l)
+	
+	def write_dot(self, f):
+		"""Streams the graph to a text file object in Graphviz's DOT format
+		
+		Nodes are labeled with their names and any keys they hold, and locked links with the keys that open them. The start
+		node is drawn as a double circle, and regions are kept as a region attribute."""
+		def quote(text):
+			return '"%s"' % strip_colors(str(text)).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+		f.write("graph dungeon {\n")
+		for n in self.nodes:
+			label = str(n)
+			if n.key_items: label += "\n" + ", ".join(str(k) for k in n.key_items)
+			f.write("\t%s [label=%s" % (n.index, quote(label)))
+			if n.region: f.write(", region=%s" % n.region)
+			if n is self.start_node: f.write(", shape=doublecircle")
+			f.write("];\n")
+		for l in self.links:
+			f.write("\t%s -- %s [id=%s" % (l.connected_nodes[0].index, l.connected_nodes[1].index, quote(l)))
+			if l.region: f.write(", region=%s" % l.region)
+			if l.required_keys: f.write(", label=%s, style=dashed" % quote(", ".join(str(k) for k in l.required_keys)))
+			f.write("];\n")
+		f.write("}\n")
+	
+	def write_graphml(self, f):
+		"""Streams the graph to a text file object as GraphML, with each element's name, region, and keys or locks as data"""
+		from xml.sax.saxutils import escape
+		f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+		f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+		for key, domain, name, kind in (
+			("name", "all", "name", "string"),
+			("region", "all", "region", "int"),
+			("keys", "node", "keys", "string"),
+			("start", "node", "start", "boolean"),
+			("locks", "edge", "locks", "string")
+		):
+			f.write('\t<key id="%s" for="%s" attr.name="%s" attr.type="%s"/>\n' % (key, domain, name, kind))
+		f.write('\t<graph id="dungeon" edgedefault="undirected">\n')
+		def data(key, value):
+			f.write('\t\t\t<data key="%s">%s</data>\n' % (key, escape(strip_colors(str(value)))))
+		for n in self.nodes:
+			f.write('\t\t<node id="n%s">\n' % n.index)
+			data("name", n)
+			if n.region: data("region", n.region)
+			if n.key_items: data("keys", ", ".join(str(k) for k in n.key_items))
+			if n is self.start_node: data("start", "true")
+			f.write("\t\t</node>\n")
+		for l in self.links:
+			f.write('\t\t<edge id="e%s" source="n%s" target="n%s">\n' % (l.index, l.connected_nodes[0].index, l.connected_nodes[1].index))
+			data("name", l)
+			if l.region: data("region", l.region)
+			if l.required_keys: data("locks", ", ".join(str(k) for k in l.required_keys))
+			f.write("\t\t</edge>\n")
+		f.write("\t</graph>\n</graphml>\n")
+	
+	def export(self, output, format=None):
+		"""Streams the graph to a path or text file object as "text" (the output of details), "dot", or "graphml"
+		
+		If format isn't given, it is taken from the path's extension, defaulting to text."""
+		is_path = isinstance(output, (str, os.PathLike))
+		if format is None:
+			extension = os.path.splitext(str(output))[1].lower() if is_path else ""
+			format = {".dot": "dot", ".gv": "dot", ".graphml": "graphml"}.get(extension, "text")
+		format = format.lower()
+		writer = {"text": self.write_details, "dot": self.write_dot, "graphml": self.write_graphml}[format]
+		if is_path:
+			with open(output, "w", encoding="utf-8") as f:
+				writer(f)
+				if format == "text": f.write("\n")
+		else:
+			writer(output)
+			if format == "text": output.write("\n")
+	
+	def to_dict(self):
+		"""Returns the graph's nodes, links, keys, and locks as plain JSON-friendly data, referring to elements by index"""
+		key_indices = {k: i for i, k in enumerate(self.keys)}
+		return {
+			"version": FORMAT_VERSION,
+			"start_node": self.start_node.index if self.start_node else None,
+			"nodes": [{"id": n.id, "region": n.region} for n in self.nodes],
+			"links": [{"id": l._id, "nodes": [l.connected_nodes[0].index, l.connected_nodes[1].index], "region": l.region, "keys": [key_indices[k] for k in l.required_keys]} for l in self.links],
+			"keys": [{"id": k.id, "region": k.region, "location": k.location.index if k.location else None} for k in self.keys]
+		}
+	
+	@classmethod
+	def from_dict(cls, data):
+		"""Returns a graph built from the output of to_dict"""
+		if data.get("version", 1) > FORMAT_VERSION:
+			raise GraphError("Graph data is version %s, but only versions up to %s are supported." % (data["version"], FORMAT_VERSION))
+		graph = cls()
+		graph.free_links = None
+		for n in data["nodes"]:
+			graph.add_node(node_id=n["id"], region=n["region"])
+		for l in data["links"]:
+			link = graph.link_nodes(graph.nodes[l["nodes"][0]], graph.nodes[l["nodes"][1]])
+			link.region = l["region"]
+			if l["id"] is not None: link.id = l["id"]
+		for k in data["keys"]:
+			key_item = KeyItem(k["id"], region=k["region"])
+			if k["location"] is not None: graph.nodes[k["location"]].add_key_item(key_item)
+			graph.keys.append(key_item)
+		for link, l in zip(graph.links, data["links"]):
+			for i in l["keys"]:
+				link.add_required_key(graph.keys[i])
+		if data["start_node"] is not None: graph.set_start_node(graph.nodes[data["start_node"]])
+		graph.rebuild_link_pools()
+		return graph
 	
 	@classmethod
 	def random_graph(cls,
@@ -53,34 +208,61 @@ class Graph():
 		region_key_chance=0.7, # for each lock, chance that it will be region-specific rather than global
 		extra_locks_for_global_keys=10, # number of extra locks to be places for non-region keys (i.e. the same key will open multiple locks)
 		priority_for_low_link_nodes=1, # when selecting which node to expand from, this multiplier will be used as a weight when randomly selecting nodes with fewer links (i.e. when this is higher, nodes with fewer links will be prioritized)
-		avoid_redundant_links=True # try to avoid linking two nodes that are already linked
+		avoid_redundant_links=True, # try to avoid linking two nodes that are already linked
+		max_attempts=5, # number of times to build a new topology before giving up
+		max_key_retries=10, # number of failed key placements per attempt, each undoing the most recent key, before building a new topology
+		max_lock_retries=10, # number of failed extra lock placements per attempt, each undoing the most recent extra lock, before building a new topology
+		rng=None, # random.Random or NumPy Generator used for all random choices (defaults to the random module's shared state)
+		stats=None # GenerationStats to record phase timings and counters in
 	):
 		## TODO:
 		## option to prioritize/force more even distribution of links (i.e. avoid dead ends)
 		## option to prioritize linking off of regions or non-regions
 		
-		logging.info(
-			f"""Generating a random graph with the following settings:
-	node_count={node_count},
-	max_links_per_node={max_links_per_node},
-	key_count={key_count},
-	loopback_chance_from_none={loopback_chance_from_none}, 
-	loopback_chance_from_region={loopback_chance_from_region},
-	regions_can_connect={regions_can_connect},
-	region_chance_from_none={region_chance_from_none},
-	region_chance_from_region={region_chance_from_region},
-	region_key_chance={region_key_chance},
-	extra_locks_for_global_keys={extra_locks_for_global_keys},
-	priority_for_low_link_nodes={priority_for_low_link_nodes},
-	avoid_redundant_links={avoid_redundant_links}"""
+		logger.info(
+			"""Generating a random graph with the following settings:
+	node_count=%s,
+	max_links_per_node=%s,
+	key_count=%s,
+	loopback_chance_from_none=%s, 
+	loopback_chance_from_region=%s,
+	regions_can_connect=%s,
+	region_chance_from_none=%s,
+	region_chance_from_region=%s,
+	region_key_chance=%s,
+	extra_locks_for_global_keys=%s,
+	priority_for_low_link_nodes=%s,
+	avoid_redundant_links=%s,
+	max_attempts=%s,
+	max_key_retries=%s,
+	max_lock_retries=%s""",
+			node_count,
+			max_links_per_node,
+			key_count,
+			loopback_chance_from_none,
+			loopback_chance_from_region,
+			regions_can_connect,
+			region_chance_from_none,
+			region_chance_from_region,
+			region_key_chance,
+			extra_locks_for_global_keys,
+			priority_for_low_link_nodes,
+			avoid_redundant_links,
+			max_attempts,
+			max_key_retries,
+			max_lock_retries
 		)
 		attempts = 0
-		max_attempts = 5
 		while attempts < max_attempts:
 			graph_success = True
 			attempts += 1
-			logging.info("Starting attempt #%s..." % attempts)
-			graph = cls()
+			logger.info("Starting attempt #%s...", attempts)
+			graph = cls(rng=rng)
+			graph.stats = stats
+			if stats is not None:
+				stats.start_attempt()
+				stats.start_phase("topology")
+			graph.expansion_index = ExpansionIndex(max_links_per_node, priority_for_low_link_nodes, rng=graph.rng)
 			next_node_id = 1
 			start_node = graph.add_node(node_id=str(next_node_id))
 			graph.set_start_node(start_node)
@@ -88,29 +270,20 @@ class Graph():
 			current_region = 1
 			while len(graph.nodes) <= node_count:
 				# pick which node to expand from
-				node_options = [n for n in graph.nodes if len(n.links) < max_links_per_node]
-				if len(node_options) == 0:
-					logging.error("Could not find any valid nodes to continue graph; aborting this attempt.")
+				if len(graph.expansion_index) == 0:
+					logger.error("Could not find any valid nodes to continue graph; aborting this attempt.")
 					graph_success = False
 					break
-				if priority_for_low_link_nodes == 1:
-					current_node = random.choice(node_options)
-				else:
-					current_node = random.choices(node_options, weights = [priority_for_low_link_nodes**(max_links_per_node-len(n.links)-1) for n in node_options])[0]
+				current_node = graph.expansion_index.choice()
 				# see if we should loop back to an existing node instead of creating a new one
-				roll = random.random()
-				if len(node_options) > 1 and ((current_node.region and roll < loopback_chance_from_region) or roll < loopback_chance_from_none):
-					linked_node_choices = [n for n in node_options if n is not current_node]
-					if current_node.region and not regions_can_connect:
-						linked_node_choices = [n for n in linked_node_choices if (n.region == None or n.region == current_node.region)]
-					if avoid_redundant_links:
-						linked_node_choices = [n for n in linked_node_choices if current_node not in n.get_linked_nodes()]
-					if len(linked_node_choices) > 0:
-						linked_node = random.choice(linked_node_choices)
+				roll = graph.rng.random()
+				if len(graph.expansion_index) > 1 and ((current_node.region and roll < loopback_chance_from_region) or roll < loopback_chance_from_none):
+					linked_node = graph.expansion_index.choose_loopback(current_node, regions_can_connect, avoid_redundant_links)
+					if linked_node is not None:
 						graph.link_nodes(current_node, linked_node)
 						continue
 				# create a new node
-				roll = random.random()
+				roll = graph.rng.random()
 				if current_node.region:
 					needed_roll = region_chance_from_region
 				else:
@@ -123,271 +296,1671 @@ class Graph():
 				new_node = graph.add_node(node_id=str(next_node_id), region=region)
 				next_node_id += 1
 				graph.link_nodes(current_node, new_node)
-			if not graph_success: continue
-			# add keys and locks
+			if not graph_success:
+				if stats is not None: stats.end_attempt("topology_failed")
+				continue
+			# add keys and locks; when a placement fails, the most recent placement of the same phase is undone and placing
+			# continues from there, until the phase runs out of retries and the attempt starts over with a new topology
+			if stats is not None: stats.start_phase("keys")
 			key_names = list(KEY_NAMES)
+			retries = 0
 			while len(graph.keys) < key_count:
-				roll = random.random()
+				roll = graph.rng.random()
 				if current_region > 1 and roll < region_key_chance:
-					region = random.randrange(1, current_region)
+					region = graph.rng.randrange(1, current_region)
 				else:
 					region = None
-				if len([l for l in graph.links if l.region == region and len(l.required_keys)==0]) == 0:
+				if not graph.free_links_by_region.get(region):
 					region = None # failsafe for if the region we picked doesn't have any lockable links
 				key_item = KeyItem(key_names.pop(), region=region)
 				success = graph.place_key_item(key_item)
 				if not success:
-					logging.error("Could not find any valid nodes to place a key item; aborting this attempt.")
-					graph_success = False
-					break
-			if not graph_success: continue
-			while len([l for l in graph.links if len(l.required_keys)>0]) < key_count+extra_locks_for_global_keys:
-				global_keys = [k for k in graph.keys if k.region == None]
-				if len(global_keys) == 0: break
-				key = random.choice(global_keys)
-				success = graph.place_lock_for_key(key, try_again_on_failure=True)
-				if not success:
-					logging.error("Could not find any valid links to place a lock; aborting this attempt.")
-					graph_success = False
-					break
-			if not graph_success: continue
+					key_names.append(key_item.id)
+					if retries == max_key_retries:
+						logger.error("Could not find any valid nodes to place a key item; aborting this attempt.")
+						graph_success = False
+						break
+					retries += 1
+					if graph.undo_log: key_names.append(graph.undo_placement().id)
+					logger.info("Could not find any valid nodes to place a key item; retrying (%s/%s).", retries, max_key_retries)
+			if not graph_success:
+				if stats is not None: stats.end_attempt("keys_failed")
+				continue
+			if stats is not None: stats.start_phase("extra_locks")
+			if not graph.place_extra_locks(key_count+extra_locks_for_global_keys, max_lock_retries):
+				if stats is not None: stats.end_attempt("extra_locks_failed")
+				continue
+			if stats is not None: stats.end_attempt("success")
 			return graph
 		raise GraphError("Failed to create a valid graph after %s attempts; aborting graph generation." % max_attempts)
+	
+	@classmethod
+	def random_graph_by_region(cls,
+		node_count=30,
+		max_links_per_node=3,
+		key_count=10,
+		loopback_chance_from_none=0.1,
+		loopback_chance_from_region=0.2,
+		regions_can_connect=False,
+		region_chance_from_none=0.4,
+		region_chance_from_region=0.0,
+		region_key_chance=0.7,
+		extra_locks_for_global_keys=10,
+		priority_for_low_link_nodes=1,
+		avoid_redundant_links=True,
+		max_attempts=5,
+		max_key_retries=10,
+		max_lock_retries=10,
+		jobs=None, # number of worker processes that build regions (defaults to one per CPU; with one job, regions are built in this process)
+		rng=None,
+		stats=None
+	):
+		"""Generates a random graph like random_graph, building each region and its region keys in parallel worker processes
 		
+		A coarse skeleton is grown first: region-less nodes are added as usual, while each region only counts the nodes it
+		will get and the regions that branch off of it. Each region's nodes, links, and region keys are then generated in a
+		worker from its own seed (see generate_region) and stitched into the skeleton at its entry link, before the global
+		keys and extra locks are placed across the whole graph. Regions only meet the rest of the graph at their entry
+		links, so loopbacks never cross a region's border and regions_can_connect must be False. Graphs only depend on the
+		seed, not on jobs, but aren't the same as random_graph's for the same seed."""
+		if regions_can_connect: raise ValueError("random_graph_by_region() requires regions_can_connect=False.")
+		region_params = dict(
+			max_links_per_node=max_links_per_node,
+			loopback_chance_from_region=loopback_chance_from_region,
+			priority_for_low_link_nodes=priority_for_low_link_nodes,
+			avoid_redundant_links=avoid_redundant_links,
+			max_attempts=max_attempts,
+			max_key_retries=max_key_retries
+		)
+		if jobs is None: jobs = os.cpu_count() or 1
+		attempts = 0
+		while attempts < max_attempts:
+			attempts += 1
+			logger.info("Starting attempt #%s...", attempts)
+			graph = cls(rng=rng)
+			graph.stats = stats
+			if stats is not None:
+				stats.start_attempt()
+				stats.start_phase("skeleton")
+			graph.expansion_index = ExpansionIndex(max_links_per_node, priority_for_low_link_nodes, rng=graph.rng)
+			graph.set_start_node(graph.add_node(node_id="1"))
+			# each region's node count, the regions branching off of it, and its entry node once that has been added
+			regions = []
+			region_sizes = FenwickTree()
+			total_nodes = 1
+			while total_nodes <= node_count:
+				expandable = len(graph.expansion_index)
+				region_weight = region_sizes.total()
+				if expandable + region_weight == 0: break
+				# every region node is weighed as if it could still be expanded
+				roll = graph.rng.random()*(expandable + region_weight)
+				if roll < region_weight:
+					region = regions[region_sizes.find(int(roll))]
+					if graph.rng.random() < region_chance_from_region:
+						child = {"region": len(regions) + 1, "size": 1, "children": [], "entry": None}
+						region["children"].append(child)
+						regions.append(child)
+						region_sizes.append(1)
+					else:
+						region["size"] += 1
+						region_sizes.set(region["region"] - 1, region["size"])
+					total_nodes += 1
+					continue
+				current_node = graph.expansion_index.choice()
+				if expandable > 1 and graph.rng.random() < loopback_chance_from_none:
+					linked_node = graph.expansion_index.choose_loopback(current_node, False, avoid_redundant_links)
+					if linked_node is not None:
+						graph.link_nodes(current_node, linked_node)
+						continue
+				if graph.rng.random() < region_chance_from_none:
+					entry = graph.add_node(node_id=str(len(graph.nodes) + 1), region=len(regions) + 1)
+					graph.link_nodes(current_node, entry)
+					graph.expansion_index.remove_node(entry)
+					regions.append({"region": entry.region, "size": 1, "children": [], "entry": entry})
+					region_sizes.append(1)
+				else:
+					graph.link_nodes(current_node, graph.add_node(node_id=str(len(graph.nodes) + 1)))
+				total_nodes += 1
+			if total_nodes <= node_count:
+				logger.error("Could not find any valid nodes to continue graph; aborting this attempt.")
+				if stats is not None: stats.end_attempt("skeleton_failed")
+				continue
+			graph.expansion_index = None
+			key_names = list(KEY_NAMES)
+			region_keys = [[] for region in regions]
+			global_keys = []
+			for i in range(key_count):
+				key_name = key_names.pop()
+				if regions and graph.rng.random() < region_key_chance:
+					region = graph.rng.choice(regions)
+					# a region with a single node has no links of its own to lock
+					if region["size"] > 1:
+						region_keys[region["region"] - 1].append(key_name)
+						continue
+				global_keys.append(KeyItem(key_name))
+			tasks = [(region["region"], region["size"], len(region["children"]), region_keys[i], region_params, graph.rng.getrandbits(64)) for i, region in enumerate(regions)]
+			
+			if stats is not None: stats.start_phase("regions")
+			try:
+				if jobs <= 1 or len(tasks) <= 1:
+					results = [generate_region(*task) for task in tasks]
+				else:
+					results = list(map_in_pool(generate_region, tasks, jobs))
+			except GraphError as e:
+				logger.error("%s; aborting this attempt.", e)
+				if stats is not None: stats.end_attempt("regions_failed")
+				continue
+			
+			if stats is not None: stats.start_phase("stitch")
+			graph.free_links = None
+			for result in sorted(results, key=lambda result: result["region"]):
+				region = regions[result["region"] - 1]
+				core = GraphCore.from_bytes(result["core"])
+				# the entry and the link into it are already in the graph, in place of the first stub and link
+				nodes = [region["entry"], None]
+				children = iter(region["children"])
+				for i in range(2, len(core.node_regions)):
+					if core.node_regions[i]:
+						nodes.append(graph.add_node(node_id=str(len(graph.nodes) + 1), region=region["region"]))
+					else:
+						# a stub standing in for the entry of a region branching off of this one
+						child = next(children)
+						child["entry"] = graph.add_node(node_id=str(len(graph.nodes) + 1), region=child["region"])
+						nodes.append(child["entry"])
+				links = [None] + [graph.link_nodes(nodes[core.link_ends[2*i]], nodes[core.link_ends[2*i + 1]]) for i in range(1, len(core.link_regions))]
+				keys = []
+				for i, key_id in enumerate(core.key_ids):
+					key_item = KeyItem(key_id, region=region["region"])
+					nodes[core.key_locations[i]].add_key_item(key_item)
+					graph.keys.append(key_item)
+					keys.append(key_item)
+				for i, link in enumerate(links):
+					for j in core.lock_keys[core.lock_offsets[i]:core.lock_offsets[i + 1]]:
+						link.add_required_key(keys[j])
+				global_keys.extend(KeyItem(key_id) for key_id in result["unplaced"])
+			graph.rebuild_link_pools()
+			
+			if stats is not None: stats.start_phase("keys")
+			if graph.place_key_items(global_keys, max_key_retries):
+				if stats is not None: stats.end_attempt("keys_failed")
+				continue
+			if stats is not None: stats.start_phase("extra_locks")
+			if not graph.place_extra_locks(key_count+extra_locks_for_global_keys, max_lock_retries):
+				if stats is not None: stats.end_attempt("extra_locks_failed")
+				continue
+			if stats is not None: stats.end_attempt("success")
+			return graph
+		raise GraphError("Failed to create a valid graph after %s attempts; aborting graph generation." % max_attempts)
+	
 	def add_node(self, node_id="null", region=None):
 		new_node = Node(self, node_id, region=region)
+		new_node.index = len(self.nodes)
 		self.nodes.append(new_node)
+		if self.expansion_index is not None: self.expansion_index.add_node(new_node)
 		return new_node
 	
 	def set_start_node(self, node):
-		assert node in self.nodes
+		assert node.parent is self
 		self.start_node = node
 	
 	def link_nodes(self, node1, node2, required_keys=None):
-		assert node1 in self.nodes
-		assert node2 in self.nodes
+		assert node1.parent is self
+		assert node2.parent is self
 		new_link = Link(self, node1, node2, required_keys)
+		new_link.index = len(self.links)
 		self.links.append(new_link)
 		node1.links.append(new_link)
 		node2.links.append(new_link)
+		node1.neighbors.add(node2)
+		node2.neighbors.add(node1)
+		if self.expansion_index is not None:
+			self.expansion_index.update_node(node1)
+			self.expansion_index.update_node(node2)
 		if node1.region and node1.region == node2.region:
-			new_link.region = node1.region
+			new_link._region = node1.region
+		self.add_link_to_pools(new_link)
+		return new_link
+	
+	def add_link_to_pools(self, link):
+		"""Counts the link if it's locked, and adds it to the free link pools if it can take another lock"""
+		if self.free_links is None: return
+		if link.required_keys: self.locked_link_count += 1
+		if len(link.required_keys) < link.max_required_keys:
+			self.free_links[link] = None
+			self.free_links_by_region.setdefault(link.region, {})[link] = None
+	
+	def rebuild_link_pools(self):
+		"""Refills the free link pools and locked link count from scratch"""
+		self.free_links = {}
+		self.free_links_by_region = {}
+		self.locked_link_count = 0
+		for link in self.links:
+			self.add_link_to_pools(link)
+	
+	def remove_link_from_pools(self, link):
+		"""Undoes add_link_to_pools, before the link's locks or region change"""
+		if self.free_links is None: return
+		if link.required_keys: self.locked_link_count -= 1
+		if self.free_links.pop(link, False) is None:
+			del self.free_links_by_region[link.region][link]
+	
+	def get_key_bit(self, key_item):
+		"""Returns the bit used to represent a key item in lock and key ring bitsets"""
+		bit = self.key_bits.get(key_item)
+		if bit is None:
+			bit = 1 << len(self.key_bits)
+			self.key_bits[key_item] = bit
+		return bit
+	
+	def get_key_mask(self, key_items):
+		mask = 0
+		for key in key_items:
+			mask |= self.get_key_bit(key)
+		return mask
 	
 	def evaluate_link(self, link, available_keys):
-		assert link in self.links
-		for key in link.required_keys:
-			if key not in available_keys: return False
-		return True
+		"""Returns True if the link can be traversed with the given key ring (either a bitset or a collection of key items)"""
+		assert link.parent is self
+		if not isinstance(available_keys, int):
+			available_keys = self.get_key_mask(available_keys)
+		return link.lock_mask & ~available_keys == 0
 	
-	def get_available_nodes(self):
-		"""Returns a list of available nodes that are reachable from the start node, using only key items found in available nodes"""
+	def get_available_nodes(self, blocked_link=None, discovery_links=None):
+		"""Returns a list of available nodes that are reachable from the start node, using only key items found in available nodes
+		
+		If blocked_link is given, that link is treated as impassable. If discovery_links is a list, it is filled with the link
+		that was used to first reach each returned node (None for the start node)."""
 		assert self.start_node != None
-		available_keys = []
+		if self.stats is not None: self.stats.count("reachability_sweeps")
+		# Nodes are expanded in the same order as a scan that restarts from the first available node whenever anything new
+		# is found: the lowest-indexed node with pending work is always expanded next. Links that are blocked by a missing
+		# key wait in a queue for that key and only mark their endpoints as pending again once it has been collected.
+		available_keys = 0
 		available_nodes = [self.start_node]
-		finished = False
-		while not finished:
-			finished = True
-			for node in available_nodes:
-				# add any new keys to our key ring
-				for key in node.key_items:
-					if key not in available_keys:
-						available_keys.append(key)
-						finished = False
-				# see if we can traverse any links
-				for link in node.links:
-					# if a link passes, check if its connected node is new
-					if self.evaluate_link(link, available_keys):
-						other_node = link.get_destination_node(node)
-						if other_node not in available_nodes:
-							# add the new node to our list and start over
-							available_nodes.append(other_node)
-							finished = False
-				if not finished: break
+		node_indices = {self.start_node: 0}
+		pending = [0]
+		is_pending = {0}
+		blocked_links = {}
+		if discovery_links is not None: discovery_links.append(None)
+		while pending:
+			index = heapq.heappop(pending)
+			is_pending.discard(index)
+			node = available_nodes[index]
+			# add any new keys to our key ring, releasing any links that were waiting on them
+			for key in node.key_items:
+				bit = self.get_key_bit(key)
+				if available_keys & bit: continue
+				available_keys |= bit
+				for link in blocked_links.pop(bit, ()):
+					missing = link.lock_mask & ~available_keys
+					if missing:
+						blocked_links.setdefault(missing & -missing, []).append(link)
+						continue
+					for other_node in link.connected_nodes:
+						other_index = node_indices.get(other_node)
+						if other_index is not None and other_index not in is_pending:
+							is_pending.add(other_index)
+							heapq.heappush(pending, other_index)
+			# see if we can traverse any links
+			for link in node.links:
+				if link is blocked_link: continue
+				missing = link.lock_mask & ~available_keys
+				if missing:
+					blocked_links.setdefault(missing & -missing, []).append(link)
+					continue
+				other_node = link.get_destination_node(node)
+				if other_node not in node_indices:
+					node_indices[other_node] = len(available_nodes)
+					is_pending.add(len(available_nodes))
+					heapq.heappush(pending, len(available_nodes))
+					available_nodes.append(other_node)
+					if discovery_links is not None: discovery_links.append(link)
 		return available_nodes
 	
 	def place_key_item(self, key_item, try_again_on_failure=True):
 		"""Places a lock on a valid link, then places the key for the lock in an accessible node."""
-		link_options = [l for l in self.links if len(l.required_keys) < l.max_required_keys]
-		if key_item.region:
-			link_options = [l for l in link_options if l.region == key_item.region]
+		analysis = LockAnalysis(self, key_item)
+		link_options = list(analysis.link_options)
 		while len(link_options) > 0:
-			selected_link = random.choice(link_options)
-			selected_link.add_required_key(key_item)
-			node_options = [n for n in self.get_available_nodes() if len(n.key_items) < n.max_key_items]
-			if key_item.region:
-				node_options = [n for n in node_options if n.region == key_item.region]
+			selected_link = self.rng.choice(link_options)
+			node_options = analysis.get_key_node_options(selected_link)
 			if len(node_options) > 0:
-				selected_node = random.choice(node_options)
+				selected_link.add_required_key(key_item)
+				selected_node = self.rng.choice(node_options)
 				selected_node.add_key_item(key_item)
-				logging.info("Placed %s in %s for a lock on %s" % (key_item, selected_node, selected_link))
+				logger.info("Placed %s in %s for a lock on %s", key_item, selected_node, selected_link)
 				self.keys.append(key_item)
+				self.undo_log.append((key_item, selected_link, selected_node))
 				return True
 			else:
-				selected_link.remove_required_key(key_item)
 				link_options.remove(selected_link)
-				logging.info("Failed to place %s on %s" % (key_item, selected_link))
+				if self.stats is not None: self.stats.count("rejected_key_placements")
+				logger.info("Failed to place %s on %s", key_item, selected_link)
 				if not try_again_on_failure: return False
-		logging.info("Failed to place key item %s" % (key_item))
+		logger.info("Failed to place key item %s", key_item)
 		return False
 	
 	def place_lock_for_key(self, key_item, try_again_on_failure=True):
 		"""Places a lock for an already-placed key item. Meant for reusable keys."""
-		link_options = [l for l in self.links if len(l.required_keys) < l.max_required_keys]
-		if key_item.region:
-			link_options = [l for l in link_options if l.region == key_item.region]
+		analysis = LockAnalysis(self, key_item)
+		link_options = list(analysis.link_options)
 		while len(link_options) > 0:
-			selected_link = random.choice(link_options)
-			selected_link.add_required_key(key_item)
-			available_nodes = self.get_available_nodes()
-			if key_item.location in available_nodes:
-				logging.info("Placed a lock on %s for %s" % (selected_link, key_item))
+			selected_link = self.rng.choice(link_options)
+			if analysis.is_valid_lock(selected_link):
+				selected_link.add_required_key(key_item)
+				logger.info("Placed a lock on %s for %s", selected_link, key_item)
+				self.undo_log.append((key_item, selected_link, None))
 				return True
 			else:
 				link_options.remove(selected_link)
-				selected_link.remove_required_key(key_item)
+				if self.stats is not None: self.stats.count("rejected_lock_placements")
 				if not try_again_on_failure: return False
 		return False
 	
+	def place_key_items(self, key_items, max_retries=10):
+		"""Places a lock and key for each key item in turn, returning the key items left over if max_retries placements fail
+		
+		Each time a placement fails, the most recently placed key is undone and placed again before trying once more."""
+		pending = key_items[::-1]
+		retries = 0
+		while pending:
+			key_item = pending.pop()
+			if not self.place_key_item(key_item):
+				pending.append(key_item)
+				if retries == max_retries:
+					logger.error("Could not find any valid nodes to place a key item; giving up on %s key items.", len(pending))
+					return pending[::-1]
+				retries += 1
+				if self.undo_log: pending.append(self.undo_placement())
+				logger.info("Could not find any valid nodes to place a key item; retrying (%s/%s).", retries, max_retries)
+		return []
+	
+	def place_extra_locks(self, lock_count, max_retries=10):
+		"""Places more locks for randomly chosen global keys until lock_count links are locked, returning False if
+		max_retries placements fail
+		
+		Each time a placement fails, the most recent of these extra locks is undone before trying again."""
+		checkpoint = len(self.undo_log)
+		retries = 0
+		global_keys = [k for k in self.keys if k.region == None]
+		while self.locked_link_count < lock_count and len(global_keys) > 0:
+			key = self.rng.choice(global_keys)
+			success = self.place_lock_for_key(key, try_again_on_failure=True)
+			if not success:
+				if retries == max_retries:
+					logger.error("Could not find any valid links to place a lock; aborting this attempt.")
+					return False
+				retries += 1
+				if len(self.undo_log) > checkpoint: self.undo_placement()
+				logger.info("Could not find any valid links to place a lock; retrying (%s/%s).", retries, max_retries)
+		return True
+	
+	def undo_placement(self):
+		"""Removes the most recent key or lock placed by place_key_item or place_lock_for_key, returning its key item"""
+		key_item, link, node = self.undo_log.pop()
+		link.remove_required_key(key_item)
+		if node is not None:
+			node.remove_key_item(key_item)
+			self.keys.remove(key_item)
+		if self.stats is not None: self.stats.count("undone_placements")
+		logger.info("Undid the placement of %s on %s", key_item, link)
+		return key_item
+	
 	def validate(self):
 		return len(self.get_available_nodes()) == len(self.nodes)
 	
-	def draw(self, max_tries=3, max_iterations=1000, max_force=30000):
+	def analyze_progression(self):
+		"""Returns a ProgressionAnalysis of the graph's spheres and key dependencies"""
+		return ProgressionAnalysis(self)
+	
+	def compact(self):
+		"""Returns a compact, array-backed copy of the graph"""
+		return GraphCore(self)
+	
+	def fingerprint(self, max_rounds=None):
+		"""Returns a structural hash that ignores names and region numbers (see GraphCore.fingerprint)"""
+		return self.compact().fingerprint(max_rounds)
+	
+	def get_layout(self, max_tries=3, max_iterations=1000, max_force=30000, rng=None):
+		"""Returns a dict of force-directed [x, y] positions for every node and link"""
+		layout = ForceLayout(self, max_force=max_force, rng=rng)
+		layout.run(max_tries=max_tries, max_iterations=max_iterations)
+		return layout.get_positions()
+	
+	def draw(self, max_tries=3, max_iterations=1000, max_force=30000, rng=None):
 		"""Creates a force-directed graph representation"""
-		spring_strength=0.4 #0.4
-		antigravity_strength=40000 #400000
+		blobs = self.get_layout(max_tries=max_tries, max_iterations=max_iterations, max_force=max_force, rng=rng)
+		GraphRenderer(self, blobs, rng=rng).get_image().show()
+	
+	def render(self, output, positions=None, format=None, scale=1, max_size=None, tile_size=None, rng=None):
+		"""Writes a force-directed graph representation to a path or file object as PNG or SVG
 		
-		size = (len(self.nodes) + len(self.links))*75
-		convergence_threshold = 10
+		If positions aren't given, a layout is computed first. See GraphRenderer.write for the remaining options."""
+		if positions is None: positions = self.get_layout(rng=rng)
+		return GraphRenderer(self, positions, scale=scale, max_size=max_size, rng=rng).write(output, format=format, tile_size=tile_size)
+
+class GenerationStats():
+	"""Phase timings and counters recorded while Graph.random_graph generates a graph.
+	
+	Each attempt is recorded as a dict with how it ended, the seconds spent in each phase ("topology", "keys", and
+	"extra_locks", or "skeleton", "regions", "stitch", "keys", and "extra_locks" for Graph.random_graph_by_region, whose
+	workers' counters aren't included), and counters for full reachability sweeps, partial searches for nodes lost
+	behind a lock candidate, candidate links rejected by place_key_item and place_lock_for_key, and placements undone to
+	retry a phase. The stats are kept on the generated graph as Graph.stats, and if a sink is given, it is called with
+	each attempt's record as soon as the attempt finishes."""
+	COUNTERS = ("reachability_sweeps", "lost_node_searches", "rejected_key_placements", "rejected_lock_placements", "undone_placements")
+	
+	def __init__(self, sink=None):
+		self.sink = sink
+		self.attempts = []
+		self.current = None
+		self.phase = None
+		self.phase_start = None
+	
+	def __str__(self):
+		lines = []
+		for attempt in self.attempts:
+			phases = ", ".join("%s %.3fs" % (phase, seconds) for phase, seconds in attempt["phases"].items())
+			counters = ", ".join("%s %s" % (name.replace("_", " "), count) for name, count in attempt["counters"].items())
+			lines.append("Attempt #%s (%s): %s; %s" % (attempt["attempt"], attempt["result"], phases, counters))
+		lines.append("%s attempts (%s restarts) in %.3fs" % (len(self.attempts), self.restarts, self.total_time))
+		return "\n".join(lines)
+	
+	@property
+	def restarts(self):
+		return max(len(self.attempts) - 1, 0)
+	
+	@property
+	def total_time(self):
+		return sum(sum(attempt["phases"].values()) for attempt in self.attempts)
+	
+	def to_dict(self):
+		return {"attempts": self.attempts, "restarts": self.restarts, "total_time": self.total_time}
+	
+	def start_attempt(self):
+		self.current = {"attempt": len(self.attempts) + 1, "result": None, "phases": {}, "counters": dict.fromkeys(self.COUNTERS, 0)}
+		self.attempts.append(self.current)
+	
+	def start_phase(self, phase):
+		self.end_phase()
+		self.phase = phase
+		self.phase_start = time.perf_counter()
+	
+	def end_phase(self):
+		if self.phase is None: return
+		phases = self.current["phases"]
+		phases[self.phase] = phases.get(self.phase, 0) + time.perf_counter() - self.phase_start
+		self.phase = None
+	
+	def end_attempt(self, result):
+		self.end_phase()
+		self.current["result"] = result
+		if self.sink: self.sink(self.current)
+		self.current = None
+	
+	def count(self, counter, amount=1):
+		if self.current is not None: self.current["counters"][counter] += amount
+
+class LockAnalysis():
+	"""Works out what stays reachable when a new lock for a key item is placed on any one link.
+	
+	A single traversal records the link each node was discovered through. Locking a link that no node was discovered
+	through leaves the reachable nodes unchanged. Otherwise, only the nodes whose discovery depended on that link (through
+	the node they were discovered from, or through the location of a key needed on the way) can be lost, and those are
+	re-checked with a search that starts from the surviving nodes and never leaves the dependent set."""
+	def __init__(self, graph, key_item):
+		self.graph = graph
+		self.key_item = key_item
+		if key_item.region:
+			self.link_options = list(graph.free_links_by_region.get(key_item.region, ()))
+		else:
+			self.link_options = list(graph.free_links)
+		discovery_links = []
+		self.available_nodes = graph.get_available_nodes(discovery_links=discovery_links)
+		self.node_indices = {n: i for i, n in enumerate(self.available_nodes)}
+		self.available_keys = 0
+		for node in self.available_nodes:
+			self.available_keys |= graph.get_key_mask(node.key_items)
+		self.key_node_options = [n for n in self.available_nodes if len(n.key_items) < n.max_key_items]
+		if key_item.region:
+			self.key_node_options = [n for n in self.key_node_options if n.region == key_item.region]
+		# the node first reached through each discovery link, and the nodes whose discovery relied on each node
+		self.cut_indices = {}
+		self.dependents = [[] for n in self.available_nodes]
+		for i in range(1, len(self.available_nodes)):
+			link = discovery_links[i]
+			self.cut_indices[link] = i
+			self.dependents[self.node_indices[link.get_destination_node(self.available_nodes[i])]].append(i)
+			for key in link.required_keys:
+				self.dependents[self.node_indices[key.location]].append(i)
+	
+	def get_lost_nodes(self, link):
+		"""Returns the set of available nodes that can no longer be reached when the link is locked"""
+		cut_index = self.cut_indices.get(link)
+		if cut_index is None: return set()
+		if self.graph.stats is not None: self.graph.stats.count("lost_node_searches")
+		lost_nodes = {self.available_nodes[cut_index]}
+		stack = [cut_index]
+		while stack:
+			for i in self.dependents[stack.pop()]:
+				node = self.available_nodes[i]
+				if node not in lost_nodes:
+					lost_nodes.add(node)
+					stack.append(i)
+		# some dependent nodes may still have a route around the link, so search for them from the surviving nodes
+		available_keys = self.available_keys & ~self.graph.get_key_mask(k for n in lost_nodes for k in n.key_items)
+		pending = []
+		surviving = set()
+		blocked_links = {}
+		for node in lost_nodes:
+			for l in node.links:
+				if l is link: continue
+				other_node = l.get_destination_node(node)
+				if other_node in lost_nodes or other_node not in self.node_indices: continue
+				missing = l.lock_mask & ~available_keys
+				if missing:
+					blocked_links.setdefault(missing & -missing, []).append(l)
+				elif node not in surviving:
+					surviving.add(node)
+					pending.append(node)
+		lost_nodes.difference_update(surviving)
+		while pending:
+			node = pending.pop()
+			for key in node.key_items:
+				bit = self.graph.get_key_bit(key)
+				if available_keys & bit: continue
+				available_keys |= bit
+				for l in blocked_links.pop(bit, ()):
+					missing = l.lock_mask & ~available_keys
+					if missing:
+						blocked_links.setdefault(missing & -missing, []).append(l)
+						continue
+					node1, node2 = l.connected_nodes
+					if node1 in lost_nodes and node2 not in lost_nodes: node1, node2 = node2, node1
+					if node2 in lost_nodes and node1 not in lost_nodes:
+						lost_nodes.discard(node2)
+						pending.append(node2)
+			for l in node.links:
+				if l is link: continue
+				other_node = l.get_destination_node(node)
+				if other_node not in lost_nodes: continue
+				missing = l.lock_mask & ~available_keys
+				if missing:
+					blocked_links.setdefault(missing & -missing, []).append(l)
+				else:
+					lost_nodes.discard(other_node)
+					pending.append(other_node)
+		return lost_nodes
+	
+	def get_key_node_options(self, link):
+		"""Returns the nodes that can hold the key item when the link is locked"""
+		lost_nodes = self.get_lost_nodes(link)
+		return [n for n in self.key_node_options if n not in lost_nodes]
+	
+	def is_valid_lock(self, link):
+		"""Returns True if the key item's location stays reachable when the link is locked"""
+		return self.key_item.location in self.node_indices and self.key_item.location not in self.get_lost_nodes(link)
+
+class ProgressionAnalysis():
+	"""Spheres and key dependencies of a graph, worked out in a single traversal from the start node.
+	
+	Sphere 0 holds the nodes reachable without any keys, and each following sphere holds the nodes that only become
+	reachable once every key found in the spheres before it has been collected. Each node is reached along a route that
+	stays in the earliest possible spheres, and the keys locking the links of that route are its key requirements. A
+	key's dependencies are the requirements of the node it's in, and its unlock depth is 0 if it has none, or one more
+	than the deepest of them otherwise."""
+	def __init__(self, graph):
+		assert graph.start_node is not None
+		self.graph = graph
+		self.spheres = []
+		self.node_spheres = {graph.start_node: 0}
+		# the keys locking the route to each node, as a bitset
+		self.route_masks = {graph.start_node: 0}
+		keys_by_bit = {}
+		available_keys = 0
+		blocked_links = {}
+		sphere = [graph.start_node]
+		while sphere:
+			index = len(self.spheres)
+			self.spheres.append(sphere)
+			found_keys = 0
+			for node in sphere:
+				for key in node.key_items:
+					bit = graph.get_key_bit(key)
+					keys_by_bit[bit] = key
+					found_keys |= bit
+				for link in node.links:
+					other_node = link.get_destination_node(node)
+					if other_node in self.node_spheres: continue
+					missing = link.lock_mask & ~available_keys
+					if missing:
+						blocked_links.setdefault(missing & -missing, []).append((link, node))
+						continue
+					self.node_spheres[other_node] = index
+					self.route_masks[other_node] = self.route_masks[node] | link.lock_mask
+					sphere.append(other_node)
+			# collect the sphere's keys, and start the next sphere from the links they open
+			sphere = []
+			new_keys = found_keys & ~available_keys
+			available_keys |= new_keys
+			while new_keys:
+				bit = new_keys & -new_keys
+				new_keys ^= bit
+				for link, node in blocked_links.pop(bit, ()):
+					missing = link.lock_mask & ~available_keys
+					if missing:
+						blocked_links.setdefault(missing & -missing, []).append((link, node))
+						continue
+					other_node = link.get_destination_node(node)
+					if other_node in self.node_spheres: continue
+					self.node_spheres[other_node] = index + 1
+					self.route_masks[other_node] = self.route_masks[node] | link.lock_mask
+					sphere.append(other_node)
+		self.unreachable_nodes = [n for n in graph.nodes if n not in self.node_spheres]
+		# keys are visited in sphere order, so each key's dependencies already have a depth
+		self.key_dependencies = {}
+		self.unlock_depths = {}
+		for node in (n for sphere in self.spheres for n in sphere):
+			for key in node.key_items:
+				mask = self.route_masks[node]
+				dependencies = []
+				while mask:
+					bit = mask & -mask
+					mask ^= bit
+					dependencies.append(keys_by_bit[bit])
+				self.key_dependencies[key] = dependencies
+				self.unlock_depths[key] = max((self.unlock_depths[k] + 1 for k in dependencies), default=0)
+	
+	def __str__(self):
+		return "Progression Analysis (%s Spheres/Unlock Depth %s)" % (len(self.spheres), self.get_max_unlock_depth())
+	
+	def get_max_unlock_depth(self):
+		"""Returns the length of the longest chain of keys that each need the one before, or None if there are no keys"""
+		return max(self.unlock_depths.values(), default=None)
+	
+	def get_clear_path(self):
+		"""Returns a walk from the start node that visits every reachable node, as a list of nodes
 		
-		blobs = dict.fromkeys(self.nodes + self.links)
-		for b in blobs:
-			blobs[b] = [size*random.random(), size*random.random()]
-		blobs[self.start_node] = [size/2, size/2]
+		Finding the shortest such walk is as hard as the travelling salesman problem, so this greedily heads for the
+		nearest unvisited node that can be reached with the keys collected so far. Each step is a breadth-first search, so
+		this is much slower than the rest of the analysis on large graphs."""
+		from collections import deque
+		graph = self.graph
+		current = graph.start_node
+		path = [current]
+		visited = {current}
+		keys = graph.get_key_mask(current.key_items)
+		while len(visited) < len(self.node_spheres):
+			parents = {current: None}
+			queue = deque([current])
+			target = None
+			while queue:
+				node = queue.popleft()
+				if node not in visited:
+					target = node
+					break
+				for link in node.links:
+					if link.lock_mask & ~keys: continue
+					other_node = link.get_destination_node(node)
+					if other_node not in parents:
+						parents[other_node] = node
+						queue.append(other_node)
+			if target is None: break
+			route = []
+			node = target
+			while node is not current:
+				route.append(node)
+				node = parents[node]
+			path.extend(reversed(route))
+			visited.add(target)
+			keys |= graph.get_key_mask(target.key_items)
+			current = target
+		return path
+	
+	def details(self):
+		s = "Progression:"
+		s += "\n\tSphere sizes: %s" % ", ".join(str(len(sphere)) for sphere in self.spheres)
+		if self.unreachable_nodes: s += "\n\tUnreachable nodes: %s" % ", ".join(str(n) for n in self.unreachable_nodes)
+		s += "\n\tClear path length: %s" % (len(self.get_clear_path()) - 1)
+		for key, depth in self.unlock_depths.items():
+			s += "\n\t%s (Sphere %s, Unlock depth %s)" % (key, self.node_spheres[key.location], depth)
+			if self.key_dependencies[key]: s += "\n\t\tNeeds: %s" % ", ".join(str(k) for k in self.key_dependencies[key])
+		return s
+	
+	def to_dict(self, clear_path=False):
+		"""Returns the analysis as JSON-friendly scores, including the clear path's length if clear_path is True"""
+		scores = {
+			"sphere_sizes": [len(sphere) for sphere in self.spheres],
+			"unreachable_nodes": len(self.unreachable_nodes),
+			"max_unlock_depth": self.get_max_unlock_depth(),
+			"unlock_depths": {str(k): depth for k, depth in self.unlock_depths.items()},
+			"key_dependencies": {str(k): [str(d) for d in dependencies] for k, dependencies in self.key_dependencies.items()}
+		}
+		if clear_path: scores["clear_path_length"] = len(self.get_clear_path()) - 1
+		return scores
+
+class PlaythroughSimulator():
+	"""Headless playthroughs of a graph by many agents at once, for measuring how long a dungeon takes to clear.
+	
+	Agents start at the start node with no keys, pick up the key in each room they enter, and count a step for every
+	link they take or try. The "random" policy picks any link at random, bumping into locks it can't open; the
+	"wanderer" policy picks among the links it can open, like the wanderer in adventure; and the "greedy" policy tries
+	links it hasn't tried yet, remembering which locks it has bumped into until it finds their keys, and heads back
+	along the links it has taken to the nearest room with an untried link when it runs out. The graph's links, locks and
+	keys are read once into flat lists (from Graph.compact), and if NumPy is installed, random and wanderer agents all
+	take each step together."""
+	POLICIES = ("random", "wanderer", "greedy")
+	
+	def __init__(self, graph, rng=None):
+		if rng is None and isinstance(graph, Graph): rng = graph.rng
+		self.rng = get_rng(rng)
+		core = graph.compact() if isinstance(graph, Graph) else graph
+		assert core.start_node >= 0
+		self.start = core.start_node
+		self.node_count = len(core.node_regions)
+		self.offsets = list(core.adjacency_offsets)
+		self.adjacency = list(core.adjacency)
+		self.link_ends = list(core.link_ends)
+		self.lock_masks = [0]*len(core.link_regions)
+		for i in range(len(self.lock_masks)):
+			for j in core.lock_keys[core.lock_offsets[i]:core.lock_offsets[i + 1]]:
+				self.lock_masks[i] |= 1 << j
+		self.key_masks = [0]*self.node_count
+		for j, location in enumerate(core.key_locations):
+			if location >= 0: self.key_masks[location] |= 1 << j
+		self.key_count = len(core.key_locations)
+	
+	def run(self, policy="random", agents=1000, max_steps=None):
+		"""Plays the graph with the given number of agents, returning a dict of per-agent lists
+		
+		"steps" holds how many steps each agent took to visit every node (None if it hadn't after max_steps, which
+		defaults to 100 steps per node), "locked_attempts" how many of them were spent bumping into locks, and
+		"backtracks" how many of them led back into rooms that had already been visited."""
+		if policy not in self.POLICIES: raise ValueError("Unknown policy %s; expected one of %s" % (policy, ", ".join(self.POLICIES)))
+		if max_steps is None: max_steps = 100*self.node_count
+		if policy != "greedy" and self.key_count < 63:
+			try:
+				import numpy
+			except ImportError:
+				numpy = None
+			if numpy: return self.run_numpy(numpy, policy, agents, max_steps)
+		results = {"steps": [], "locked_attempts": [], "backtracks": []}
+		for i in range(agents):
+			steps, locked_attempts, backtracks = self.play(policy, max_steps)
+			results["steps"].append(steps)
+			results["locked_attempts"].append(locked_attempts)
+			results["backtracks"].append(backtracks)
+		return results
+	
+	def play(self, policy, max_steps):
+		"""Plays through once, returning the steps to clear (or None), locked attempts, and backtracks"""
+		rng = self.rng
+		offsets, adjacency, link_ends, lock_masks, key_masks = self.offsets, self.adjacency, self.link_ends, self.lock_masks, self.key_masks
+		node = self.start
+		keys = key_masks[node]
+		visited = {node}
+		taken_links = set()
+		locked_links = set()
+		locked_attempts = backtracks = 0
+		if len(visited) == self.node_count: return 0, 0, 0
+		for step in range(1, max_steps + 1):
+			links = adjacency[offsets[node]:offsets[node + 1]]
+			if policy == "random":
+				link = rng.choice(links)
+			elif policy == "wanderer":
+				links = [l for l in links if not lock_masks[l] & ~keys]
+				if not links: return None, locked_attempts, backtracks
+				link = rng.choice(links)
+			else:
+				link = self.get_greedy_link(node, keys, taken_links, locked_links)
+				if link is None: return None, locked_attempts, backtracks
+			if lock_masks[link] & ~keys:
+				locked_attempts += 1
+				locked_links.add(link)
+				continue
+			taken_links.add(link)
+			node = link_ends[2*link] if link_ends[2*link + 1] == node else link_ends[2*link + 1]
+			if node in visited:
+				backtracks += 1
+				continue
+			visited.add(node)
+			keys |= key_masks[node]
+			if len(visited) == self.node_count: return step, locked_attempts, backtracks
+		return None, locked_attempts, backtracks
+	
+	def get_greedy_link(self, node, keys, taken_links, locked_links):
+		"""Returns a random untried link from the node, or the first link on the way back to the nearest node with one
 		
+		Links that were found to be locked only count as untried again once the key for them has been found."""
+		offsets, adjacency, link_ends, lock_masks = self.offsets, self.adjacency, self.link_ends, self.lock_masks
+		def is_untried(link):
+			return link not in taken_links and (link not in locked_links or not lock_masks[link] & ~keys)
+		options = [l for l in adjacency[offsets[node]:offsets[node + 1]] if is_untried(l)]
+		if options: return self.rng.choice(options)
+		# search back along taken links, which are always open
+		first_links = {node: None}
+		queue = [node]
+		for current in queue:
+			for link in adjacency[offsets[current]:offsets[current + 1]]:
+				if is_untried(link): return first_links[current]
+				if link not in taken_links: continue
+				other = link_ends[2*link] if link_ends[2*link + 1] == current else link_ends[2*link + 1]
+				if other not in first_links:
+					first_links[other] = link if current == node else first_links[current]
+					queue.append(other)
+		return None
+	
+	def run_numpy(self, numpy, policy, agents, max_steps):
+		generator = numpy.random.default_rng(self.rng.randrange(2**63))
+		offsets = numpy.array(self.offsets, dtype=numpy.int64)
+		adjacency = numpy.array(self.adjacency, dtype=numpy.int64)
+		ends = numpy.array(self.link_ends, dtype=numpy.int64).reshape(-1, 2)
+		lock_masks = numpy.array(self.lock_masks, dtype=numpy.int64)
+		key_masks = numpy.array(self.key_masks, dtype=numpy.int64)
+		nodes = numpy.full(agents, self.start, dtype=numpy.int64)
+		keys = numpy.full(agents, self.key_masks[self.start], dtype=numpy.int64)
+		visited = numpy.zeros((agents, self.node_count), dtype=bool)
+		visited[:, self.start] = True
+		visited_counts = numpy.ones(agents, dtype=numpy.int64)
+		steps = numpy.full(agents, -1, dtype=numpy.int64)
+		locked_attempts = numpy.zeros(agents, dtype=numpy.int64)
+		backtracks = numpy.zeros(agents, dtype=numpy.int64)
+		active = numpy.arange(agents) if self.node_count > 1 else numpy.arange(0)
+		steps[:] = -1 if self.node_count > 1 else 0
+		for step in range(1, max_steps + 1):
+			if len(active) == 0: break
+			node = nodes[active]
+			first, degree = offsets[node], offsets[node + 1] - offsets[node]
+			link = adjacency[first + (generator.random(len(active))*degree).astype(numpy.int64)]
+			is_open = lock_masks[link] & ~keys[active] == 0
+			if policy == "wanderer":
+				# draw again for agents that picked a lock they can't open, giving up on agents that are locked in
+				for attempt in range(100):
+					retry = numpy.flatnonzero(~is_open)
+					if len(retry) == 0: break
+					link[retry] = adjacency[first[retry] + (generator.random(len(retry))*degree[retry]).astype(numpy.int64)]
+					is_open[retry] = lock_masks[link[retry]] & ~keys[active[retry]] == 0
+			locked_attempts[active[~is_open]] += 1
+			movers, link = active[is_open], link[is_open]
+			destination = numpy.where(ends[link, 0] == nodes[movers], ends[link, 1], ends[link, 0])
+			nodes[movers] = destination
+			seen = visited[movers, destination]
+			backtracks[movers[seen]] += 1
+			movers, destination = movers[~seen], destination[~seen]
+			visited[movers, destination] = True
+			visited_counts[movers] += 1
+			keys[movers] |= key_masks[destination]
+			done = visited_counts[active] == self.node_count
+			steps[active[done]] = step
+			active = active[~done]
+		return {
+			"steps": [None if s < 0 else s for s in steps.tolist()],
+			"locked_attempts": locked_attempts.tolist(),
+			"backtracks": backtracks.tolist()
+		}
+	
+	def details(self, agents=1000, max_steps=None):
+		"""Runs every policy, returning a summary of each as text"""
+		s = "Playthroughs (%s agents per policy):" % agents
+		for policy in self.POLICIES:
+			summary = self.summarize(self.run(policy, agents, max_steps))
+			s += "\n\t%s: %.1f%% cleared" % (policy, 100*summary["clear_rate"])
+			if summary["steps"]: s += " in %(mean).1f steps on average (median %(median)s, 90th percentile %(p90)s, max %(max)s)" % summary["steps"]
+			s += "; %.1f locked attempts and %.1f backtracks on average" % (summary["locked_attempts"]["mean"], summary["backtracks"]["mean"])
+		return s
+	
+	@staticmethod
+	def summarize(results):
+		"""Returns the clear rate, plus the mean, median, 90th percentile, and maximum of each measure across agents"""
+		import statistics
+		def distribution(values):
+			if not values: return None
+			values = sorted(values)
+			return {"mean": statistics.fmean(values), "median": statistics.median(values), "p90": values[min(len(values) - 1, int(0.9*len(values)))], "max": values[-1]}
+		cleared = [s for s in results["steps"] if s is not None]
+		return {
+			"agents": len(results["steps"]),
+			"clear_rate": len(cleared)/len(results["steps"]) if results["steps"] else None,
+			"steps": distribution(cleared),
+			"locked_attempts": distribution(results["locked_attempts"]),
+			"backtracks": distribution(results["backtracks"])
+		}
+
+class FenwickTree():
+	"""Running totals over a growable list of weights, with O(log n) updates and weighted searches"""
+	def __init__(self):
+		self.values = []
+		self.tree = [0]
+	
+	def __len__(self):
+		return len(self.values)
+	
+	def append(self, value):
+		i = len(self.tree)
+		total = value
+		j = i - 1
+		while j > i - (i & -i):
+			total += self.tree[j]
+			j -= j & -j
+		self.values.append(value)
+		self.tree.append(total)
+	
+	def set(self, index, value):
+		delta = value - self.values[index]
+		if delta == 0: return
+		self.values[index] = value
+		i = index + 1
+		while i < len(self.tree):
+			self.tree[i] += delta
+			i += i & -i
+	
+	def total(self):
+		return self.prefix_sum(len(self.values))
+	
+	def prefix_sum(self, count):
+		"""Returns the sum of the first count weights"""
+		total = 0
+		while count > 0:
+			total += self.tree[count]
+			count -= count & -count
+		return total
+	
+	def find(self, target):
+		"""Returns the index of the first weight where the running total exceeds target"""
+		index = 0
+		step = 1 << (len(self.tree) - 1).bit_length()
+		while step:
+			if index + step < len(self.tree) and self.tree[index + step] <= target:
+				index += step
+				target -= self.tree[index]
+			step >>= 1
+		return index
+
+class ExpansionIndex():
+	"""Tracks the nodes that can still take new links while a graph is being generated.
+	
+	Nodes are kept in creation order, so picking the k-th expandable node matches picking from a freshly filtered list of
+	the graph's nodes. When nodes with fewer links are prioritized, nodes are also bucketed by link count so that a
+	weighted pick only has to weigh the handful of buckets before searching within one. Expandable nodes are also counted
+	by region, so a loopback target can be picked from the nodes that could actually be linked without listing them."""
+	def __init__(self, max_links_per_node, priority_for_low_link_nodes=1, rng=None):
+		self.rng = get_rng(rng)
+		self.max_links_per_node = max_links_per_node
+		self.priority_for_low_link_nodes = priority_for_low_link_nodes
+		self.nodes = []
+		self.node_indices = {}
+		self.expandable = FenwickTree()
+		# for each region, expandable flags and creation indices of its nodes, and each node's position in its region
+		self.region_trees = {}
+		self.region_indices = {}
+		self.region_positions = {}
+		if priority_for_low_link_nodes == 1:
+			self.buckets = None
+		else:
+			self.bucket_weights = [priority_for_low_link_nodes**(max_links_per_node-c-1) for c in range(max_links_per_node)]
+			self.buckets = [FenwickTree() for c in range(max_links_per_node)]
+	
+	def __len__(self):
+		return self.expandable.total()
+	
+	def add_node(self, node):
+		self.node_indices[node] = len(self.nodes)
+		self.nodes.append(node)
+		self.expandable.append(0)
+		if node.region not in self.region_trees:
+			self.region_trees[node.region] = FenwickTree()
+			self.region_indices[node.region] = []
+		self.region_positions[node] = len(self.region_indices[node.region])
+		self.region_trees[node.region].append(0)
+		self.region_indices[node.region].append(self.node_indices[node])
+		if self.buckets:
+			for bucket in self.buckets:
+				bucket.append(0)
+		self.update_node(node)
+	
+	def update_node(self, node):
+		"""Refreshes a node's entry after its links have changed"""
+		index = self.node_indices[node]
+		link_count = len(node.links)
+		self.expandable.set(index, 1 if link_count < self.max_links_per_node else 0)
+		self.region_trees[node.region].set(self.region_positions[node], self.expandable.values[index])
+		if self.buckets:
+			for c, bucket in enumerate(self.buckets):
+				bucket.set(index, 1 if c == link_count else 0)
+	
+	def remove_node(self, node):
+		"""Stops a node from being picked or offered as a loopback, until its links change again"""
+		index = self.node_indices[node]
+		self.expandable.set(index, 0)
+		self.region_trees[node.region].set(self.region_positions[node], 0)
+		if self.buckets:
+			for bucket in self.buckets:
+				bucket.set(index, 0)
+	
+	def choose_loopback(self, node, regions_can_connect=False, avoid_redundant_links=True):
+		"""Returns a random expandable node that a new link from the node could connect to, or None if there isn't one
+		
+		The pick matches rng.choice over the candidates in creation order, but candidates are only counted: the node and
+		its neighbors are skipped by their rank among the candidates, and the chosen rank is found with the Fenwick trees,
+		in O(log n) time (O(log^2 n) when a region node may only link to its own region and region-less nodes)."""
+		if node.region and not regions_can_connect:
+			groups = [region for region in (None, node.region) if region in self.region_trees]
+			def get_rank(index):
+				# the number of candidates created before the node at index
+				rank = 0
+				for region in groups:
+					rank += self.region_trees[region].prefix_sum(bisect.bisect_left(self.region_indices[region], index))
+				return rank
+			count = sum(self.region_trees[region].total() for region in groups)
+			is_candidate = lambda n: n.region in groups and self.expandable.values[self.node_indices[n]]
+		else:
+			get_rank = self.expandable.prefix_sum
+			count = len(self)
+			is_candidate = lambda n: self.expandable.values[self.node_indices[n]]
+		skipped = [node]
+		if avoid_redundant_links: skipped.extend(node.neighbors)
+		skipped_ranks = sorted(get_rank(self.node_indices[n]) for n in skipped if is_candidate(n))
+		if count == len(skipped_ranks): return None
+		target = self.rng.randrange(count - len(skipped_ranks))
+		for rank in skipped_ranks:
+			if rank <= target: target += 1
+		if get_rank is self.expandable.prefix_sum:
+			return self.nodes[self.expandable.find(target)]
+		# the candidate at rank target is the last node whose rank is target
+		low, high = 0, len(self.nodes) - 1
+		while low < high:
+			middle = (low + high + 1)//2
+			if get_rank(middle) <= target: low = middle
+			else: high = middle - 1
+		return self.nodes[low]
+	
+	def choice(self):
+		"""Picks a random expandable node, weighted toward nodes with fewer links if a priority was given"""
+		if not self.buckets:
+			return self.nodes[self.expandable.find(self.rng.randrange(len(self)))]
+		totals = [bucket.total() for bucket in self.buckets]
+		total_weight = sum(w*t for w, t in zip(self.bucket_weights, totals))
+		if total_weight <= 0:
+			raise ValueError("No expandable node has a positive weight; check priority_for_low_link_nodes")
+		roll = self.rng.random() * total_weight
+		last = None
+		for weight, count, bucket in zip(self.bucket_weights, totals, self.buckets):
+			if weight <= 0 or count == 0: continue
+			if roll < weight*count:
+				return self.nodes[bucket.find(min(int(roll/weight), count - 1))]
+			roll -= weight*count
+			last = bucket
+		return self.nodes[last.find(last.total() - 1)]
+
+class GraphCore():
+	"""Compact, array-backed copy of a graph, for keeping many generated graphs in memory.
+	
+	Nodes, links and keys are referred to by their index in the original graph. Each node's links are a slice of
+	adjacency starting at adjacency_offsets[node], and each link's required keys are a slice of lock_keys starting at
+	lock_offsets[link]. Regions use 0 for region-less elements and key locations use -1 for unplaced keys. Node and link
+	names are only kept if they differ from the generator's defaults. Use to_graph() to get a full Graph back."""
+	__slots__ = (
+		"node_ids", "node_regions", "node_max_key_items",
+		"link_ends", "link_ids", "link_regions", "link_max_required_keys",
+		"adjacency_offsets", "adjacency", "lock_offsets", "lock_keys",
+		"key_ids", "key_locations", "key_regions", "key_flags",
+		"start_node"
+	)
+	
+	REUSABLE = 1
+	USED = 2
+	# the arrays written by to_bytes, in order
+	ARRAYS = (
+		"node_regions", "node_max_key_items",
+		"link_ends", "link_regions", "link_max_required_keys",
+		"adjacency_offsets", "adjacency", "lock_offsets", "lock_keys",
+		"key_locations", "key_regions", "key_flags"
+	)
+	
+	def __init__(self, graph):
+		self.node_ids = [n.id for n in graph.nodes]
+		if all(node_id == str(i + 1) for i, node_id in enumerate(self.node_ids)): self.node_ids = None
+		self.node_regions = array("i", (n.region or 0 for n in graph.nodes))
+		self.node_max_key_items = array("B", (n.max_key_items for n in graph.nodes))
+		self.link_ends = array("i")
+		for l in graph.links:
+			self.link_ends.append(l.connected_nodes[0].index)
+			self.link_ends.append(l.connected_nodes[1].index)
+		self.link_ids = [l._id for l in graph.links]
+		if all(link_id is None for link_id in self.link_ids): self.link_ids = None
+		self.link_regions = array("i", (l.region or 0 for l in graph.links))
+		self.link_max_required_keys = array("B", (l.max_required_keys for l in graph.links))
+		self.adjacency_offsets = array("i", [0])
+		self.adjacency = array("i")
+		for n in graph.nodes:
+			self.adjacency.extend(l.index for l in n.links)
+			self.adjacency_offsets.append(len(self.adjacency))
+		key_indices = {k: i for i, k in enumerate(graph.keys)}
+		self.lock_offsets = array("i", [0])
+		self.lock_keys = array("i")
+		for l in graph.links:
+			self.lock_keys.extend(key_indices[k] for k in l.required_keys)
+			self.lock_offsets.append(len(self.lock_keys))
+		self.key_ids = [k.id for k in graph.keys]
+		self.key_locations = array("i", (k.location.index if k.location else -1 for k in graph.keys))
+		self.key_regions = array("i", (k.region or 0 for k in graph.keys))
+		self.key_flags = array("B", ((self.REUSABLE if k.reusable else 0) | (self.USED if k.used else 0) for k in graph.keys))
+		self.start_node = graph.start_node.index if graph.start_node else -1
+	
+	def __str__(self):
+		return "Graph Core (%s Nodes/%s Links)" % (len(self.node_regions), len(self.link_regions))
+	
+	def to_graph(self):
+		"""Returns a full Graph with the same nodes, links, keys and locks"""
+		graph = Graph()
+		graph.free_links = None
+		for i in range(len(self.node_regions)):
+			node = graph.add_node(node_id=self.node_ids[i] if self.node_ids else str(i + 1), region=self.node_regions[i] or None)
+			node.max_key_items = self.node_max_key_items[i]
+		for i in range(len(self.link_regions)):
+			link = graph.link_nodes(graph.nodes[self.link_ends[2*i]], graph.nodes[self.link_ends[2*i + 1]])
+			link.max_required_keys = self.link_max_required_keys[i]
+			link.region = self.link_regions[i] or None
+			if self.link_ids: link.id = self.link_ids[i]
+		for i, node in enumerate(graph.nodes):
+			node.links = [graph.links[j] for j in self.adjacency[self.adjacency_offsets[i]:self.adjacency_offsets[i + 1]]]
+		for i in range(len(self.key_ids)):
+			key_item = KeyItem(self.key_ids[i], reusable=bool(self.key_flags[i] & self.REUSABLE), region=self.key_regions[i] or None)
+			key_item.used = bool(self.key_flags[i] & self.USED)
+			if self.key_locations[i] >= 0: graph.nodes[self.key_locations[i]].add_key_item(key_item)
+			graph.keys.append(key_item)
+		for i, link in enumerate(graph.links):
+			for j in self.lock_keys[self.lock_offsets[i]:self.lock_offsets[i + 1]]:
+				link.add_required_key(graph.keys[j])
+		if self.start_node >= 0: graph.set_start_node(graph.nodes[self.start_node])
+		graph.rebuild_link_pools()
+		return graph
+	
+	def to_bytes(self):
+		"""Returns the graph in a compact little-endian binary form that from_bytes can read back
+		
+		The start node comes first, followed by each of the ARRAYS as a length and its raw items, and finally the node, link
+		and key names as a length-prefixed JSON list."""
+		import json, struct, sys
+		parts = [struct.pack("<i", self.start_node)]
+		for name in self.ARRAYS:
+			values = getattr(self, name)
+			if sys.byteorder == "big":
+				values = array(values.typecode, values)
+				values.byteswap()
+			parts.append(struct.pack("<I", len(values)))
+			parts.append(values.tobytes())
+		names = json.dumps([self.node_ids, self.link_ids, self.key_ids], separators=(",", ":")).encode()
+		parts.append(struct.pack("<I", len(names)))
+		parts.append(names)
+		return b"".join(parts)
+	
+	@classmethod
+	def from_bytes(cls, data):
+		"""Returns a GraphCore read from the output of to_bytes"""
+		import json, struct, sys
+		core = cls.__new__(cls)
+		data = memoryview(data)
+		core.start_node, = struct.unpack_from("<i", data, 0)
+		offset = 4
+		for name in cls.ARRAYS:
+			values = array("B" if name in ("node_max_key_items", "link_max_required_keys", "key_flags") else "i")
+			length, = struct.unpack_from("<I", data, offset)
+			offset += 4
+			values.frombytes(data[offset:offset + length*values.itemsize])
+			offset += length*values.itemsize
+			if sys.byteorder == "big": values.byteswap()
+			setattr(core, name, values)
+		length, = struct.unpack_from("<I", data, offset)
+		core.node_ids, core.link_ids, core.key_ids = json.loads(bytes(data[offset + 4:offset + 4 + length]))
+		return core
+	
+	def get_available_nodes(self):
+		"""Returns the indices of nodes reachable from the start node, in the same order as Graph.get_available_nodes"""
+		assert self.start_node >= 0
+		lock_masks = [0]*len(self.link_regions)
+		for i in range(len(lock_masks)):
+			for j in self.lock_keys[self.lock_offsets[i]:self.lock_offsets[i + 1]]:
+				lock_masks[i] |= 1 << j
+		node_keys = {}
+		for i, location in enumerate(self.key_locations):
+			if location >= 0: node_keys.setdefault(location, []).append(i)
+		available_keys = 0
+		available_nodes = [self.start_node]
+		node_indices = {self.start_node: 0}
+		pending = [0]
+		is_pending = {0}
+		blocked_links = {}
+		while pending:
+			index = heapq.heappop(pending)
+			is_pending.discard(index)
+			node = available_nodes[index]
+			for key in node_keys.get(node, ()):
+				bit = 1 << key
+				if available_keys & bit: continue
+				available_keys |= bit
+				for link in blocked_links.pop(bit, ()):
+					missing = lock_masks[link] & ~available_keys
+					if missing:
+						blocked_links.setdefault(missing & -missing, []).append(link)
+						continue
+					for other_node in (self.link_ends[2*link], self.link_ends[2*link + 1]):
+						other_index = node_indices.get(other_node)
+						if other_index is not None and other_index not in is_pending:
+							is_pending.add(other_index)
+							heapq.heappush(pending, other_index)
+			for link in self.adjacency[self.adjacency_offsets[node]:self.adjacency_offsets[node + 1]]:
+				missing = lock_masks[link] & ~available_keys
+				if missing:
+					blocked_links.setdefault(missing & -missing, []).append(link)
+					continue
+				other_node = self.link_ends[2*link] if self.link_ends[2*link + 1] == node else self.link_ends[2*link + 1]
+				if other_node not in node_indices:
+					node_indices[other_node] = len(available_nodes)
+					is_pending.add(len(available_nodes))
+					heapq.heappush(pending, len(available_nodes))
+					available_nodes.append(other_node)
+		return available_nodes
+	
+	def validate(self):
+		return len(self.get_available_nodes()) == len(self.node_regions)
+	
+	def fingerprint(self, max_rounds=None):
+		"""Returns a hex digest that is the same for graphs that only differ in names, element order, and region numbers
+		
+		Nodes, links, keys, and regions are treated as the vertices of one graph, joined where a link connects a node, a
+		key is placed on a node or required by a link, or an element belongs to a region. Each vertex starts with a label
+		of its kind (marking the start node and each key's flags), and Weisfeiler-Lehman refinement then relabels every
+		vertex with its own and its neighbors' labels until no labels split (or for max_rounds). The digest covers every
+		round's labels and how many vertices ended up with each. Like any WL hash, it can't tell apart some highly regular
+		structures, but different dungeons almost never share one."""
+		import hashlib
+		node_count, link_count, key_count = len(self.node_regions), len(self.link_regions), len(self.key_regions)
+		regions = sorted((set(self.node_regions) | set(self.link_regions) | set(self.key_regions)) - {0})
+		region_vertices = {region: node_count + link_count + key_count + i for i, region in enumerate(regions)}
+		neighbors = [[] for i in range(node_count + link_count + key_count + len(regions))]
+		def join(a, b):
+			neighbors[a].append(b)
+			neighbors[b].append(a)
+		labels = [("node", i == self.start_node) for i in range(node_count)]
+		labels.extend(("link",) for i in range(link_count))
+		labels.extend(("key", flags) for flags in self.key_flags)
+		labels.extend(("region",) for region in regions)
+		for i, region in enumerate(self.node_regions):
+			if region: join(i, region_vertices[region])
+		for i, region in enumerate(self.link_regions):
+			link = node_count + i
+			join(link, self.link_ends[2*i])
+			join(link, self.link_ends[2*i + 1])
+			if region: join(link, region_vertices[region])
+			for j in self.lock_keys[self.lock_offsets[i]:self.lock_offsets[i + 1]]:
+				join(link, node_count + link_count + j)
+		for i, region in enumerate(self.key_regions):
+			key = node_count + link_count + i
+			if self.key_locations[i] >= 0: join(key, self.key_locations[i])
+			if region: join(key, region_vertices[region])
+		
+		digest = hashlib.sha256()
+		def relabel(signatures):
+			# number the distinct signatures in sorted order, so isomorphic graphs get the same numbers
+			table = sorted(set(signatures))
+			digest.update(repr(table).encode())
+			numbers = {signature: i for i, signature in enumerate(table)}
+			return [numbers[signature] for signature in signatures], len(table)
+		colors, color_count = relabel(labels)
+		rounds = 0
+		while max_rounds is None or rounds < max_rounds:
+			colors, new_color_count = relabel([(colors[v], tuple(sorted(colors[u] for u in neighbors[v]))) for v in range(len(neighbors))])
+			rounds += 1
+			if new_color_count == color_count: break
+			color_count = new_color_count
+		histogram = [0]*color_count
+		for color in colors: histogram[color] += 1
+		digest.update(repr(histogram).encode())
+		return digest.hexdigest()
+
+class ForceLayout():
+	"""Force-directed layout of a graph, with every node and link placed as a blob.
+	
+	Blobs push each other away with a force that falls off with the square of their distance, and each link is pulled
+	toward its two nodes by a spring. The start node stays rooted in the middle. Forces are clamped to max_force, and the
+	layout has converged once no blob is pushed further than convergence_threshold in an iteration. If NumPy is available,
+	all blobs move at once each iteration, and above barnes_hut_threshold blobs the push between them is approximated
+	with a Barnes-Hut quadtree; otherwise blobs are moved one at a time in pure Python."""
+	def __init__(self, graph, max_force=30000, spring_strength=0.4, antigravity_strength=40000, convergence_threshold=10, barnes_hut_threshold=300, barnes_hut_theta=0.5, rng=None):
+		self.graph = graph
+		self.rng = graph.rng if rng is None else get_rng(rng)
+		self.max_force = max_force
+		self.spring_strength = spring_strength
+		self.antigravity_strength = antigravity_strength
+		self.convergence_threshold = convergence_threshold
+		self.barnes_hut_threshold = barnes_hut_threshold
+		self.barnes_hut_theta = barnes_hut_theta
+		# nodes take the first blob indices and links the rest
+		self.elements = graph.nodes + graph.links
+		self.root = graph.start_node.index
+		self.springs = [[len(graph.nodes) + l.index for l in n.links] for n in graph.nodes]
+		self.springs += [[n.index for n in l.connected_nodes] for l in graph.links]
+		self.size = len(self.elements)*75
+		self.positions = [[self.size*self.rng.random(), self.size*self.rng.random()] for b in self.elements]
+		self.positions[self.root] = [self.size/2, self.size/2]
+	
+	def run(self, max_tries=3, max_iterations=1000):
+		"""Moves the blobs until the layout converges; returns False if it never did"""
+		try:
+			import numpy
+		except ImportError:
+			numpy = None
+		if numpy:
+			positions = numpy.array(self.positions, dtype=float)
+			spring_pairs = numpy.array([(i, j) for i, partners in enumerate(self.springs[:len(self.graph.nodes)]) for j in partners], dtype=int).reshape(-1, 2)
+			# all nodes move at once from the same positions, then all links: a simultaneous (Jacobi-style) update that
+			# converges to a similar layout to moving blobs one at a time, but not the same one
+			groups = [numpy.array([i for i in range(len(self.graph.nodes)) if i != self.root], dtype=int), numpy.arange(len(self.graph.nodes), len(self.elements))]
 		success = False
 		try_count = 0
 		while not success:
 			try_count += 1
-			logging.info("Starting attempt #%s at drawing graph %s..." % (try_count, self))
+			logger.info("Starting attempt #%s at drawing graph %s...", try_count, self.graph)
 			success = True
 			converged = False
-			max_iterations = 1000
 			iteration = 0
 			while not converged:
 				iteration += 1
 				if iteration > max_iterations:
-					logging.warning("Exceeded maximum iterations of %s; aborting" % max_iterations)
+					logger.warning("Exceeded maximum iterations of %s; aborting", max_iterations)
+					success = False
+					break
+				if numpy:
+					converged = self.step_numpy(numpy, positions, spring_pairs, groups)
+				else:
+					converged = self.step()
+				if converged is None:
+					logger.warning("OverflowError; aborting")
 					success = False
 					break
-				converged = True
-				for b in blobs:
-					if b == self.start_node: continue # keep the start node rooted in place
-					try:
-						f = [0, 0]
-						# antigravity pushing away from other blobs
-						for other in blobs:
-							if other is b: continue
-							v = [blobs[b][0] - blobs[other][0], blobs[b][1] - blobs[other][1]]
-							r = math.sqrt(v[0]**2 + v[1]**2)
-							r = max(r, 1)
-							d = [v[0]/r, v[1]/r]
-							strength = antigravity_strength/(r**2)
-							f = [f[0] + strength*d[0], f[1] + strength*d[1]]
-						# spring pulling links together
-						if type(b) == Node:
-							for other in b.links:
-								v = [blobs[other][0] - blobs[b][0], blobs[other][1] - blobs[b][1]]
-								r = math.sqrt(v[0]**2 + v[1]**2)
-								r = max(r, 1)
-								d = [v[0]/r, v[1]/r]
-								strength = spring_strength * r
-								f = [f[0] + strength*d[0], f[1] + strength*d[1]]
-						elif type(b) == Link:
-							for other in b.connected_nodes:
-								v = [blobs[other][0] - blobs[b][0], blobs[other][1] - blobs[b][1]]
-								r = math.sqrt(v[0]**2 + v[1]**2)
-								r = max(r, 1)
-								d = [v[0]/r, v[1]/r]
-								strength = spring_strength * r
-								f = [f[0] + strength*d[0], f[1] + strength*d[1]]
-						if max_force > 0:
-							# limit force
-							force_magnitude = math.sqrt(f[0]**2 + f[1]**2)
-							if force_magnitude > max_force:
-								f = [f[0]/force_magnitude*max_force, f[1]/force_magnitude*max_force]
-						# apply force
-						blobs[b] = [blobs[b][0] + f[0], blobs[b][1] + f[1]]
-						# constrain blob positions
-						blobs[b][0] = max(min(blobs[b][0], size), 0)
-						blobs[b][1] = max(min(blobs[b][1], size), 0)
-						if math.sqrt(f[0]**2 + f[1]**2) > convergence_threshold:
-							converged = False
-					except OverflowError:
-						logging.warning("OverflowError; aborting")
-						success = False
-						break
 			if try_count > max_tries:
-				logging.error("Could not draw a graph after %s attempts of %s iterations." % (max_tries, max_iterations))
+				logger.error("Could not draw a graph after %s attempts of %s iterations.", max_tries, max_iterations)
 				break
+		if numpy:
+			self.positions = positions.tolist()
+		return success
+	
+	def get_positions(self):
+		"""Returns a dict mapping every node and link to its [x, y] position"""
+		return dict(zip(self.elements, self.positions))
+	
+	def step(self):
+		"""Moves each blob in turn; returns whether the layout has converged, or None if the forces overflowed"""
+		converged = True
+		positions = self.positions
+		for b, position in enumerate(positions):
+			if b == self.root: continue # keep the start node rooted in place
+			try:
+				f = [0, 0]
+				# antigravity pushing away from other blobs
+				for other, other_position in enumerate(positions):
+					if other == b: continue
+					v = [position[0] - other_position[0], position[1] - other_position[1]]
+					r = max(math.sqrt(v[0]**2 + v[1]**2), 1)
+					strength = self.antigravity_strength/(r**3)
+					f = [f[0] + strength*v[0], f[1] + strength*v[1]]
+				# spring pulling links together
+				for other in self.springs[b]:
+					f = [f[0] + self.spring_strength*(positions[other][0] - position[0]), f[1] + self.spring_strength*(positions[other][1] - position[1])]
+				if self.max_force > 0:
+					# limit force
+					force_magnitude = math.sqrt(f[0]**2 + f[1]**2)
+					if force_magnitude > self.max_force:
+						f = [f[0]/force_magnitude*self.max_force, f[1]/force_magnitude*self.max_force]
+				# apply force, constraining blob positions
+				positions[b] = [max(min(position[0] + f[0], self.size), 0), max(min(position[1] + f[1], self.size), 0)]
+				if math.sqrt(f[0]**2 + f[1]**2) > self.convergence_threshold:
+					converged = False
+			except OverflowError:
+				return None
+		return converged
+	
+	def step_numpy(self, numpy, positions, spring_pairs, groups):
+		"""Moves each group of blobs at once; returns whether the layout has converged, or None if the forces overflowed"""
+		converged = True
+		for group in groups:
+			if len(group) == 0: continue
+			if len(positions) > self.barnes_hut_threshold:
+				forces = self.get_barnes_hut_repulsion(numpy, positions, group)
+			else:
+				v = positions[group][:, None, :] - positions[None, :, :]
+				r = numpy.maximum(numpy.sqrt((v**2).sum(axis=2)), 1)
+				forces = self.antigravity_strength*(v/(r**3)[:, :, None]).sum(axis=1)
+			v = self.spring_strength*(positions[spring_pairs[:, 1]] - positions[spring_pairs[:, 0]])
+			springs = numpy.zeros_like(positions)
+			numpy.add.at(springs, spring_pairs[:, 0], v)
+			numpy.add.at(springs, spring_pairs[:, 1], -v)
+			forces += springs[group]
+			force_magnitudes = numpy.sqrt((forces**2).sum(axis=1))
+			if not numpy.isfinite(force_magnitudes).all(): return None
+			if self.max_force > 0:
+				scale = numpy.minimum(1, self.max_force/numpy.maximum(force_magnitudes, 1e-12))
+				forces *= scale[:, None]
+				force_magnitudes *= scale
+			positions[group] = numpy.clip(positions[group] + forces, 0, self.size)
+			if (force_magnitudes > self.convergence_threshold).any():
+				converged = False
+		return converged
+	
+	def get_barnes_hut_repulsion(self, numpy, positions, targets, depth=16, leaf_size=16):
+		"""Returns the antigravity on each target blob, treating distant groups of blobs as a single heavier blob.
+		
+		Blobs are sorted along a Morton curve, so every quadtree cell is a contiguous run of sorted blobs and a cell's
+		children are a contiguous run of the next level's cells. The tree is then walked one level at a time for all
+		targets at once, with each (target, cell) pair either using the cell's center of mass, summing over the cell's
+		blobs directly, or moving on to the cell's children."""
+		low = positions.min(axis=0)
+		width = max(float((positions.max(axis=0) - low).max()), 1)
+		grid = numpy.minimum(((positions - low)/width*(1 << depth)).astype(numpy.int64), (1 << depth) - 1)
+		codes = spread_bits(numpy, grid[:, 0]) | (spread_bits(numpy, grid[:, 1]) << 1)
+		order = numpy.argsort(codes, kind="stable")
+		codes = codes[order]
+		sorted_positions = positions[order]
+		levels = []
+		for level in range(depth + 1):
+			cell_codes, starts, counts = numpy.unique(codes >> 2*(depth - level), return_index=True, return_counts=True)
+			centers = numpy.add.reduceat(sorted_positions, starts, axis=0)/counts[:, None]
+			levels.append((cell_codes, starts, counts, centers))
+		
+		forces = numpy.zeros((len(targets), 2))
+		target_positions = positions[targets]
+		def add_forces(pair_targets, v, weights):
+			r = numpy.maximum(numpy.sqrt((v**2).sum(axis=1)), 1)
+			f = self.antigravity_strength*weights/(r**3)
+			forces[:, 0] += numpy.bincount(pair_targets, weights=f*v[:, 0], minlength=len(targets))
+			forces[:, 1] += numpy.bincount(pair_targets, weights=f*v[:, 1], minlength=len(targets))
+		def expand(pair_targets, firsts, sizes):
+			# pairs each target with every index in [first, first + size)
+			offsets = numpy.arange(sizes.sum()) - numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+			return numpy.repeat(pair_targets, sizes), numpy.repeat(firsts, sizes) + offsets
 		
+		pair_targets = numpy.arange(len(targets))
+		pair_cells = numpy.zeros(len(targets), dtype=int)
+		for level, (cell_codes, starts, counts, centers) in enumerate(levels):
+			v = target_positions[pair_targets] - centers[pair_cells]
+			far = width/(1 << level) < self.barnes_hut_theta*numpy.sqrt((v**2).sum(axis=1))
+			add_forces(pair_targets[far], v[far], counts[pair_cells[far]])
+			leaf = ~far & ((counts[pair_cells] <= leaf_size) | (level == depth))
+			leaf_targets, members = expand(pair_targets[leaf], starts[pair_cells[leaf]], counts[pair_cells[leaf]])
+			add_forces(leaf_targets, target_positions[leaf_targets] - sorted_positions[members], 1)
+			opened = ~far & ~leaf
+			if level == depth or not opened.any(): break
+			next_codes = levels[level + 1][0]
+			first_children = numpy.searchsorted(next_codes, cell_codes[pair_cells[opened]] << 2)
+			child_counts = numpy.searchsorted(next_codes, (cell_codes[pair_cells[opened]] + 1) << 2) - first_children
+			pair_targets, pair_cells = expand(pair_targets[opened], first_children, child_counts)
+		return forces
+
+def spread_bits(numpy, values):
+	"""Spaces out the low 16 bits of each value so that two coordinates can be interleaved into a Morton code"""
+	values = (values | (values << 8)) & 0x00FF00FF
+	values = (values | (values << 4)) & 0x0F0F0F0F
+	values = (values | (values << 2)) & 0x33333333
+	return (values | (values << 1)) & 0x55555555
+
+class GraphRenderer():
+	"""Draws a graph from precomputed node and link positions.
+	
+	Nodes are drawn as boxes joined to their links, with the start node outlined in red, and locked links are drawn as
+	circles in the color of their key. Drawings can be scaled down, or capped to max_size pixels on their longest side,
+	and PNG output can be split into tiles so that only one tile is held in memory at a time. SVG output is streamed
+	straight to the file and doesn't need PIL."""
+	blob_size = 20
+	
+	def __init__(self, graph, positions, scale=1, max_size=None, rng=None):
+		self.graph = graph
+		self.rng = graph.rng if rng is None else get_rng(rng)
+		self.positions = positions
+		margin = self.blob_size + 10
+		min_x = min(p[0] for p in positions.values())
+		max_x = max(p[0] for p in positions.values())
+		min_y = min(p[1] for p in positions.values())
+		max_y = max(p[1] for p in positions.values())
+		width = int(max_x - min_x) + 2*margin
+		height = int(max_y - min_y) + 2*margin
+		if max_size: scale = min(scale, max_size/max(width, height))
+		self.scale = scale
+		self.x_offset = margin - min_x
+		self.y_offset = margin - min_y
+		self.width = max(int(width*scale), 1)
+		self.height = max(int(height*scale), 1)
+		self.key_colors = self.get_key_colors()
+	
+	def get_key_colors(self):
+		key_colors = {}
+		for n in self.graph.nodes:
+			for k in n.key_items:
+				if k not in key_colors: key_colors[k] = (self.rng.randint(50, 255), self.rng.randint(50, 255), self.rng.randint(50, 255))
+		for l in self.graph.links:
+			if len(l.required_keys) > 0 and l.required_keys[0] not in key_colors:
+				key_colors[l.required_keys[0]] = (self.rng.randint(0, 255), self.rng.randint(0, 255), self.rng.randint(0, 255))
+		return key_colors
+	
+	def get_point(self, element):
+		position = self.positions[element]
+		return ((position[0] + self.x_offset)*self.scale, (position[1] + self.y_offset)*self.scale)
+	
+	def get_shapes(self, element):
+		"""Returns the shapes drawn for a node or link, as (kind, box or point, options) tuples in image coordinates"""
+		x, y = self.get_point(element)
+		s = self.scale
+		line_width = max(int(round(2*s)), 1)
+		shapes = []
+		if isinstance(element, Node):
+			for link in element.links:
+				shapes.append(("line", (x, y) + self.get_point(link), {"fill": (0, 0, 0), "width": line_width}))
+			if element is self.graph.start_node:
+				size = (self.blob_size + 2)*s
+				shapes.append(("rectangle", (x - size, y - size, x + size, y + size), {"outline": (255, 0, 0), "fill": None, "width": line_width}))
+			size = self.blob_size*s
+			shapes.append(("rectangle", (x - size, y - size, x + size, y + size), {"outline": (0, 0, 0), "fill": (255, 255, 255), "width": line_width}))
+			for k in element.key_items:
+				size = self.blob_size/4*s
+				shapes.append(("rectangle", (x - size, y - size, x + size, y + size), {"outline": None, "fill": self.key_colors[k], "width": 0}))
+				shapes.append(("text", (x - 2*s, y - 4*s), {"text": str(k), "fill": (0, 0, 0)}))
+			shapes.append(("text", (x + (4 - self.blob_size)*s, y + (4 - self.blob_size)*s), {"text": str(element), "fill": (0, 0, 0)}))
+		elif len(element.required_keys) > 0:
+			k = element.required_keys[0]
+			size = self.blob_size/2*s
+			shapes.append(("ellipse", (x - size, y - size, x + size, y + size), {"outline": (0, 0, 0), "fill": self.key_colors[k], "width": line_width}))
+			shapes.append(("text", (x - 2*s, y - 4*s), {"text": str(k), "fill": (0, 0, 0)}))
+		return shapes
+	
+	def draw_shapes(self, draw, shapes, x_offset=0, y_offset=0):
+		for kind, box, options in shapes:
+			if kind == "text":
+				draw.text((box[0] - x_offset, box[1] - y_offset), strip_colors(options["text"]), fill=options["fill"])
+			else:
+				box = [box[0] - x_offset, box[1] - y_offset, box[2] - x_offset, box[3] - y_offset]
+				getattr(draw, kind)(box, **options)
+	
+	def get_image(self, box=None):
+		"""Returns a PIL image of the whole drawing, or of the (left, top, right, bottom) part of it given by box"""
 		from PIL import Image, ImageDraw
-		blob_size = 20
-		margin = blob_size + 10
-		min_x = min([b[0] for b in blobs.values()])
-		max_x = max([b[0] for b in blobs.values()])
-		min_y = min([b[1] for b in blobs.values()])
-		max_y = max([b[1] for b in blobs.values()])
-		x_size = int(max_x - min_x) + 2*margin
-		y_size = int(max_y - min_y) + 2*margin
-		x_offset = margin - min_x
-		y_offset = margin - min_y
-		im = Image.new("RGB", (x_size, y_size), (255, 255, 255))
+		if box is None: box = (0, 0, self.width, self.height)
+		im = Image.new("RGB", (box[2] - box[0], box[3] - box[1]), (255, 255, 255))
 		draw = ImageDraw.Draw(im)
+		margin = self.blob_size*self.scale + 100 # leaves room for labels that spill past their node
+		for element in self.graph.nodes + self.graph.links:
+			shapes = self.get_shapes(element)
+			if not shapes: continue
+			xs = [c for shape in shapes for c in shape[1][0::2]]
+			ys = [c for shape in shapes for c in shape[1][1::2]]
+			if max(xs) + margin < box[0] or min(xs) - margin > box[2] or max(ys) + margin < box[1] or min(ys) - margin > box[3]: continue
+			self.draw_shapes(draw, shapes, box[0], box[1])
+		return im
+	
+	def write(self, output, format=None, tile_size=None):
+		"""Writes the drawing to a path or file object, as "png" or "svg"
 		
-		key_color_map = {}
-		for b, position in blobs.items():
-			if type(b) == Node:
-				for link in b.links:
-					draw.line([position[0]+x_offset, position[1]+y_offset, blobs[link][0]+x_offset, blobs[link][1]+y_offset], fill=(0, 0, 0), width=2)
-				if b is self.start_node:
-					draw.rectangle([position[0]-blob_size-2+x_offset, position[1]-blob_size-2+y_offset, position[0]+blob_size+2+x_offset, position[1]+blob_size+2+y_offset], outline=(255, 0, 0), fill=None, width=2)
-				draw.rectangle([position[0]-blob_size+x_offset, position[1]-blob_size+y_offset, position[0]+blob_size+x_offset, position[1]+blob_size+y_offset], outline=(0, 0, 0), fill=(255, 255, 255), width=2)
-				if len(b.key_items) > 0:
-					for k in b.key_items:
-						if k in key_color_map:
-							key_color = key_color_map[k]
-						else:
-							key_color = (random.randint(50, 255), random.randint(50, 255), random.randint(50, 255))
-							key_color_map[k] = key_color
-						draw.rectangle([position[0]-blob_size/4+x_offset, position[1]-blob_size/4+y_offset, position[0]+blob_size/4+x_offset, position[1]+blob_size/4+y_offset], fill=key_color)
-						draw.text([position[0]-2+x_offset, position[1]-4+y_offset], str(k), fill=(0, 0, 0))
-				draw.text([position[0]-blob_size+4+x_offset, position[1]-blob_size+4+y_offset], str(b), fill=(0, 0, 0))
-			else: # Link
-				if len(b.required_keys) > 0:
-					k = b.required_keys[0]
-					size = blob_size/2
-					if k in key_color_map:
-						color = key_color_map[k]
-					else:
-						color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-						key_color_map[k] = color
+		If format isn't given, it is taken from the path's extension, defaulting to PNG. If tile_size is given, a PNG
+		drawing is split into tiles of at most tile_size pixels square, written next to the path as name_row_column.png.
+		Returns the list of paths written, or an empty list for file objects."""
+		is_path = isinstance(output, (str, os.PathLike))
+		if format is None:
+			format = "svg" if is_path and str(output).lower().endswith(".svg") else "png"
+		format = format.lower()
+		if format == "svg":
+			if is_path:
+				with open(output, "w", encoding="utf-8") as f:
+					self.write_svg(f)
+				return [output]
+			self.write_svg(output)
+			return []
+		if tile_size is None:
+			self.get_image().save(output, format="PNG")
+			return [output] if is_path else []
+		if not is_path: raise ValueError("Tiled drawings must be written to a path.")
+		root, extension = os.path.splitext(output)
+		paths = []
+		for row, top in enumerate(range(0, self.height, tile_size)):
+			for column, left in enumerate(range(0, self.width, tile_size)):
+				path = "%s_%s_%s%s" % (root, row, column, extension or ".png")
+				self.get_image((left, top, min(left + tile_size, self.width), min(top + tile_size, self.height))).save(path, format="PNG")
+				paths.append(path)
+		return paths
+	
+	def write_svg(self, f):
+		"""Streams the drawing to a text file object as SVG, one element at a time"""
+		from xml.sax.saxutils import escape
+		def color(c):
+			return "none" if c is None else "rgb(%s,%s,%s)" % c
+		f.write('<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" font-family="monospace" font-size="%.1f">\n' % (self.width, self.height, 10*self.scale))
+		f.write('<rect width="100%" height="100%" fill="white"/>\n')
+		for element in self.graph.nodes + self.graph.links:
+			for kind, box, options in self.get_shapes(element):
+				if kind == "line":
+					f.write('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="%s" stroke-width="%s"/>\n' % (box + (color(options["fill"]), options["width"])))
+				elif kind == "rectangle":
+					f.write('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="%s" stroke="%s" stroke-width="%s"/>\n' % (box[0], box[1], box[2] - box[0], box[3] - box[1], color(options["fill"]), color(options["outline"]), options["width"]))
+				elif kind == "ellipse":
+					f.write('<ellipse cx="%.1f" cy="%.1f" rx="%.1f" ry="%.1f" fill="%s" stroke="%s" stroke-width="%s"/>\n' % ((box[0] + box[2])/2, (box[1] + box[3])/2, (box[2] - box[0])/2, (box[3] - box[1])/2, color(options["fill"]), color(options["outline"]), options["width"]))
 				else:
-					continue
-					color = (0, 0, 0)
-					size = blob_size/10
-				draw.ellipse([position[0]-size+x_offset, position[1]-size+y_offset, position[0]+size+x_offset, position[1]+size+y_offset], outline=(0, 0, 0), fill=color, width=2)
-				if len(b.required_keys) > 0:
-					draw.text([position[0]-2+x_offset, position[1]-4+y_offset], str(k), fill=(0, 0, 0))
-		im.show()
+					f.write('<text x="%.1f" y="%.1f" dominant-baseline="hanging" fill="%s">%s</text>\n' % (box[0], box[1], color(options["fill"]), escape(strip_colors(options["text"]))))
+		f.write("</svg>\n")
+
+def strip_colors(text):
+	"""Removes terminal color codes, as added to names by example_graph"""
+	return re.sub("\x1b\\[[0-9;]*m", "", text)
 
 class GraphElement():
-	pass
+	__slots__ = ()
 
 class Node(GraphElement):
+	__slots__ = ("parent", "index", "id", "links", "neighbors", "max_key_items", "key_items", "region")
+	
 	def __init__(self, parent, id, max_key_items=1, region=None):
 		self.parent = parent
+		self.index = None
 		self.id = id
 		self.links = []
+		self.neighbors = set()
 		self.max_key_items = max_key_items
 		self.key_items = []
 		self.region = region
@@ -411,17 +1984,25 @@ class Node(GraphElement):
 		self.key_items.append(key_item)
 		key_item.location = self
 		assert len(self.key_items) <= self.max_key_items
+	
+	def remove_key_item(self, key_item):
+		self.key_items.remove(key_item)
+		key_item.location = None
 
 class Link(GraphElement):
+	__slots__ = ("parent", "index", "_id", "connected_nodes", "max_required_keys", "required_keys", "lock_mask", "_region")
+	
 	def __init__(self, parent, node1, node2, required_keys=None, max_required_keys=1, region=None):
 		self.parent = parent
-		self.id = "%s/%s" % tuple(sorted((str(node1), str(node2))))
+		self.index = None
+		self._id = None
 		self.connected_nodes = (node1, node2)
 		self.max_required_keys = max_required_keys
 		if required_keys: self.required_keys = required_keys
 		else: self.required_keys = []
 		assert len(self.required_keys) <= self.max_required_keys
-		self.region = region
+		self.lock_mask = parent.get_key_mask(self.required_keys)
+		self._region = region
 	
 	def __repr__(self):
 		s = "Link %s" % self.id
@@ -432,20 +2013,49 @@ class Link(GraphElement):
 	def __str__(self):
 		return self.id
 	
+	@property
+	def id(self):
+		# unless it has been named, a link is identified by its sorted node ids
+		if self._id is None: return "%s/%s" % tuple(sorted((str(self.connected_nodes[0]), str(self.connected_nodes[1]))))
+		return self._id
+	
+	@id.setter
+	def id(self, value):
+		self._id = value
+	
+	@property
+	def region(self):
+		return self._region
+	
+	@region.setter
+	def region(self, value):
+		# move the link to its new region's free link pool
+		self.parent.remove_link_from_pools(self)
+		self._region = value
+		self.parent.add_link_to_pools(self)
+	
 	def get_destination_node(self, start_node):
 		assert start_node in self.connected_nodes
 		if start_node == self.connected_nodes[0]: return self.connected_nodes[1]
 		else: return self.connected_nodes[0]
 	
 	def add_required_key(self, key_item):
+		self.parent.remove_link_from_pools(self)
 		self.required_keys.append(key_item)
 		assert len(self.required_keys) <= self.max_required_keys
+		self.lock_mask |= self.parent.get_key_bit(key_item)
+		self.parent.add_link_to_pools(self)
 	
 	def remove_required_key(self, key_item):
 		assert key_item in self.required_keys
+		self.parent.remove_link_from_pools(self)
 		self.required_keys.remove(key_item)
+		self.lock_mask = self.parent.get_key_mask(self.required_keys)
+		self.parent.add_link_to_pools(self)
 
 class KeyItem():
+	__slots__ = ("id", "reusable", "used", "location", "region")
+	
 	def __init__(self, id, location=None, reusable=False, region=None):
 		self.id = id
 		self.reusable = reusable
@@ -462,10 +2072,786 @@ class KeyItem():
 	def can_use(self):
 		return self.reusable or not self.used
 
+class NameAllocator():
+	"""Hands out unique names made by filling a template with one word from each list of descriptors.
+	
+	Each name is a random, not yet used combination of descriptors, drawn with a sparse Fisher-Yates shuffle of the
+	combinations' indices, so drawing a name takes constant time however many have been used. Once every combination
+	has been used, the combinations are reused in order with a numbered suffix (e.g. "a big, damp room 2")."""
+	def __init__(self, template, descriptors, rng=None):
+		self.template = template
+		self.descriptors = [list(words) for words in descriptors]
+		self.rng = get_rng(rng)
+		self.size = 1
+		for words in self.descriptors:
+			self.size *= len(words)
+		self.count = 0
+		# the shuffled positions that have been swapped away from holding their own index
+		self.swaps = {}
+	
+	def __len__(self):
+		return self.size
+	
+	def next(self):
+		if self.count < self.size:
+			i = self.count + self.rng.randrange(self.size - self.count)
+			index = self.swaps.pop(i, i)
+			if i != self.count: self.swaps[i] = self.swaps.pop(self.count, self.count)
+			suffix = ""
+		else:
+			index = self.count % self.size
+			suffix = " %s" % (self.count//self.size + 1)
+		self.count += 1
+		words = []
+		for descriptor in reversed(self.descriptors):
+			index, word = divmod(index, len(descriptor))
+			words.append(descriptor[word])
+		return self.template % tuple(reversed(words)) + suffix
+
 #############################################################################################
 
-def example_graph():
+def generate_region(region, size, port_count, key_ids, params, seed):
+	"""Builds one region for Graph.random_graph_by_region in a worker (see build_region), returning its GraphCore bytes and
+	the ids of any keys that couldn't be placed in it"""
+	graph, unplaced = build_region(region, size, port_count, key_ids, params, random.Random(seed))
+	return {"region": region, "core": graph.compact().to_bytes(), "unplaced": [key_item.id for key_item in unplaced]}
+
+def build_region(region, size, port_count, key_ids, params, rng):
+	"""Returns a graph of a single region with size nodes and a list of the key items that couldn't be placed in it
+	
+	Node 0 is the region's entry and node 1 a region-less stub standing in for the node it is entered from, linked by link
+	0. Another port_count stubs stand in for the entries of the regions branching off of it. Every key gets both its lock
+	and its location inside the region, keeping every node reachable from the entry. params holds max_links_per_node,
+	loopback_chance_from_region, priority_for_low_link_nodes, avoid_redundant_links, max_attempts, and max_key_retries,
+	as for random_graph."""
+	for attempt in range(params["max_attempts"]):
+		graph = Graph(rng=rng)
+		graph.expansion_index = ExpansionIndex(params["max_links_per_node"], params["priority_for_low_link_nodes"], rng=rng)
+		graph.set_start_node(graph.add_node(node_id="1", region=region))
+		stub = graph.add_node(node_id="2")
+		graph.link_nodes(graph.start_node, stub)
+		graph.expansion_index.remove_node(stub)
+		while len(graph.nodes) < size + port_count + 1 and len(graph.expansion_index) > 0:
+			current_node = graph.expansion_index.choice()
+			if len(graph.nodes) > size:
+				stub = graph.add_node(node_id=str(len(graph.nodes) + 1))
+				graph.link_nodes(current_node, stub)
+				graph.expansion_index.remove_node(stub)
+				continue
+			if len(graph.expansion_index) > 1 and rng.random() < params["loopback_chance_from_region"]:
+				linked_node = graph.expansion_index.choose_loopback(current_node, False, params["avoid_redundant_links"])
+				if linked_node is not None:
+					graph.link_nodes(current_node, linked_node)
+					continue
+			graph.link_nodes(current_node, graph.add_node(node_id=str(len(graph.nodes) + 1), region=region))
+		if len(graph.nodes) == size + port_count + 1: break
+		logger.error("Could not find any valid nodes to continue region %s; aborting this attempt.", region)
+	else:
+		raise GraphError("Failed to create region %s after %s attempts" % (region, params["max_attempts"]))
+	graph.expansion_index = None
+	unplaced = graph.place_key_items([KeyItem(key_id, region=region) for key_id in key_ids], params["max_key_retries"])
+	return graph, unplaced
+
+def generate_record(params, seed, stats=False, analyze=False):
+	"""Generates a random graph from a seed and random_graph keyword arguments, returning a JSON-friendly record"""
+	generation_stats = GenerationStats() if stats else None
+	try:
+		graph = Graph.random_graph(rng=random.Random(seed), stats=generation_stats, **params)
+		record = {"seed": seed, "graph": graph.to_dict()}
+		if analyze: record["analysis"] = graph.analyze_progression().to_dict(clear_path=True)
+	except GraphError as e:
+		record = {"seed": seed, "error": str(e)}
+	if stats: record["stats"] = generation_stats.to_dict()
+	return record
+
+def generate_many(params, seeds, jobs=None, output=None, threads=False, stats=False, analyze=False):
+	"""Generates a random graph for each seed across a pool of worker processes, yielding records as they finish
+	
+	Each record is a dict with the seed and either the graph (as returned by Graph.to_dict) or the error that stopped it
+	from being generated, plus the generation stats (as returned by GenerationStats.to_dict) if stats is True and the
+	graph's progression scores (as returned by ProgressionAnalysis.to_dict with its clear path) if analyze is True.
+	Every graph depends only on its seed and params, so results match a single-process run, but they are yielded in the
+	order they finish. If jobs isn't given, one worker is used per CPU; with one job, graphs are generated in this
+	process. If threads is True, a thread pool is used instead of processes, which only helps on free-threaded builds of
+	Python. If output is given (a path or text file object), each record is also written to it as a line of JSON. When
+	output is a path, any old offset index next to it is removed, and a new one is written after the last record."""
+	import json
+	if jobs is None: jobs = os.cpu_count() or 1
+	path = os.fspath(output) if isinstance(output, (str, os.PathLike)) else None
+	if path is not None:
+		try:
+			os.remove(path + ".index")
+		except FileNotFoundError:
+			pass
+	f = open(path, "wb") if path is not None else output
+	offsets = array("Q")
+	try:
+		if jobs <= 1:
+			records = (generate_record(params, seed, stats, analyze) for seed in seeds)
+		else:
+			records = generate_records_in_pool(params, seeds, jobs, threads, stats, analyze)
+		for record in records:
+			if path is not None:
+				offsets.append(f.tell())
+				f.write(json.dumps(record).encode() + b"\n")
+			elif f:
+				f.write(json.dumps(record) + "\n")
+			yield record
+		if path is not None:
+			offsets.append(f.tell())
+			f.close()
+			write_offsets(path + ".index", offsets)
+	finally:
+		if f is not output: f.close()
+
+def generate_records_in_pool(params, seeds, jobs, threads=False, stats=False, analyze=False):
+	return map_in_pool(generate_record, ((params, seed, stats, analyze) for seed in seeds), jobs, threads)
+
+def map_in_pool(function, arguments, jobs, threads=False):
+	"""Yields the result of calling function with each tuple of arguments across a pool of workers, as they finish
+	
+	Only a few calls per worker are in flight at once, so finished results don't pile up in memory, and arguments are
+	only pulled from the iterator as calls are submitted, so a lazy iterator can react to earlier results."""
+	from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+	arguments = iter(arguments)
+	with (ThreadPoolExecutor if threads else ProcessPoolExecutor)(max_workers=jobs) as executor:
+		pending = set()
+		for args in arguments:
+			pending.add(executor.submit(function, *args))
+			if len(pending) >= jobs*4: break
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				yield future.result()
+				for args in arguments:
+					pending.add(executor.submit(function, *args))
+					break
+
+# ranges that sample_parameters draws random_graph parameters from: a value is picked from each list or range, and
+# uniformly between the two ends of each tuple
+SWEEP_RANGES = {
+	"node_count": range(20, 51),
+	"max_links_per_node": range(3, 6),
+	"key_count": range(10, 21),
+	"loopback_chance_from_none": (0, 0.5),
+	"loopback_chance_from_region": (0, 0.5),
+	"regions_can_connect": [True, False],
+	"region_chance_from_none": (0, 0.5),
+	"region_chance_from_region": (0, 0.5),
+	"region_key_chance": (0, 1),
+	"extra_locks_for_global_keys": range(5, 16),
+	"priority_for_low_link_nodes": range(1, 6),
+	"avoid_redundant_links": [True, False]
+}
+
+def sample_parameters(count, ranges=SWEEP_RANGES, rng=None):
+	"""Returns a list of count random parameter sets for random_graph, drawn from ranges (see SWEEP_RANGES)"""
+	rng = get_rng(rng)
+	return [{name: rng.uniform(*values) if isinstance(values, tuple) else rng.choice(values) for name, values in ranges.items()} for i in range(count)]
+
+def parameter_grid(options):
+	"""Returns a list of parameter sets for random_graph, one for every combination of the lists of values in options"""
+	import itertools
+	return [dict(zip(options, values)) for values in itertools.product(*options.values())]
+
+def evaluate_parameters(index, params, seed):
+	"""Generates a graph for sweep, returning how long it took and its progression scores instead of the graph"""
+	stats = GenerationStats()
+	result = {"index": index, "seed": seed}
+	try:
+		graph = Graph.random_graph(rng=random.Random(seed), stats=stats, **params)
+		analysis = graph.analyze_progression()
+		result["spheres"] = len(analysis.spheres)
+		result["max_unlock_depth"] = analysis.get_max_unlock_depth()
+		result["clear_path_length"] = len(analysis.get_clear_path()) - 1
+	except GraphError:
+		result["error"] = True
+	result["time"] = stats.total_time
+	result["attempts"] = len(stats.attempts)
+	return result
+
+def sweep(parameter_sets, seeds=20, jobs=None, output=None, threads=False, max_failure_rate=0.5, min_seeds=5, z=1.96):
+	"""Generates graphs from each parameter set across a pool of worker processes, yielding a summary of each set as it
+	finishes
+	
+	Every set is tried with the same seeds (a count, or a list of seeds). A set is stopped early once at least min_seeds
+	have been tried and the lower end of the Wilson score interval for its failure rate (with z standard deviations) is
+	above max_failure_rate. Results are taken in seed order, so summaries don't depend on the number of jobs. Each
+	summary holds the set's params, how many seeds were tried and failed, whether it was stopped early, the mean,
+	median, and 90th percentile generation time, the mean number of attempts, and the mean sphere count, unlock depth,
+	and clear path length of the graphs generated. If output is given, each summary is appended to it as a line of JSON
+	as soon as it is ready, and sets that already have a summary there are skipped, so an interrupted sweep can be
+	resumed by running it again."""
+	import json, statistics
+	if isinstance(seeds, int): seeds = range(seeds)
+	seeds = list(seeds)
+	if jobs is None: jobs = os.cpu_count() or 1
+	def key(params):
+		return json.dumps(params, sort_keys=True)
+	finished = set()
+	if output is not None and os.path.exists(output):
+		with open(output) as f:
+			for line in f:
+				if line.strip(): finished.add(key(json.loads(line)["params"]))
+	sets = [{"params": params, "results": {}, "tried": [], "done": False} for params in parameter_sets if key(params) not in finished]
+	def arguments():
+		for index, state in enumerate(sets):
+			for seed in seeds:
+				if state["done"]: break
+				yield index, state["params"], seed
+	def mean_or_none(values):
+		values = [value for value in values if value is not None]
+		return statistics.fmean(values) if values else None
+	def summarize(state):
+		tried = state["tried"]
+		times = sorted(r["time"] for r in tried)
+		successes = [r for r in tried if "error" not in r]
+		failures = len(tried) - len(successes)
+		return {
+			"params": state["params"],
+			"seeds": len(tried),
+			"failures": failures,
+			"failure_rate": failures/len(tried),
+			"stopped_early": len(tried) < len(seeds),
+			"time": {"mean": statistics.fmean(times), "median": statistics.median(times), "p90": times[min(len(times) - 1, int(0.9*len(times)))]},
+			"attempts": statistics.fmean(r["attempts"] for r in tried),
+			"quality": {name: mean_or_none(r[name] for r in successes) for name in ("spheres", "max_unlock_depth", "clear_path_length")}
+		}
+	
+	if jobs <= 1:
+		results = (evaluate_parameters(*args) for args in arguments())
+	else:
+		results = map_in_pool(evaluate_parameters, arguments(), jobs, threads)
+	f = open(output, "a") if output is not None else None
+	try:
+		for result in results:
+			state = sets[result["index"]]
+			if state["done"]: continue
+			state["results"][result["seed"]] = result
+			tried = state["tried"]
+			while not state["done"] and len(tried) < len(seeds) and seeds[len(tried)] in state["results"]:
+				tried.append(state["results"].pop(seeds[len(tried)]))
+				n = len(tried)
+				rate = sum(1 for r in tried if "error" in r)/n
+				lower_bound = (rate + z*z/(2*n) - z*math.sqrt(rate*(1 - rate)/n + z*z/(4*n*n)))/(1 + z*z/n)
+				state["done"] = len(tried) == len(seeds) or (n >= min_seeds and lower_bound > max_failure_rate)
+			if state["done"]:
+				state["results"] = None
+				summary = summarize(state)
+				if f:
+					f.write(json.dumps(summary) + "\n")
+					f.flush()
+				yield summary
+	finally:
+		if f: f.close()
+
+def serve_record(params, seed):
+	"""Generates and validates a graph for DungeonServer, returning whether it succeeded and its record as JSON bytes"""
+	import json
+	try:
+		graph = Graph.random_graph(rng=random.Random(seed), **params)
+		if not graph.validate(): raise GraphError("Generated graph failed validation")
+		record = {"seed": seed, "graph": graph.to_dict()}
+	except GraphError as e:
+		record = {"seed": seed, "error": str(e)}
+	return "error" not in record, json.dumps(record).encode()
+
+class DungeonServer():
+	"""Serves random graphs as JSON over localhost HTTP or a Unix socket, from warm pools of pre-generated graphs
+	
+	profiles maps each profile name to a dict of random_graph arguments. For each profile, up to pool_size validated
+	graphs are kept encoded and ready, and are refilled in the background by a pool of jobs worker processes. Requests
+	for a specific seed are generated on demand, and the last cache_size of them are kept for repeat requests.
+	
+	GET /dungeon?profile=NAME takes a graph from the profile's pool (the first profile if none is given), and
+	GET /dungeon?profile=NAME&seed=SEED returns the graph for that seed. Either returns a record like generate_record's.
+	GET /metrics returns the depth of each pool, hit and miss counts, and p50 and p99 latencies in milliseconds.
+	
+	If a profile fails to generate max_failures graphs in a row, its refill stops until the next request for it, and
+	requests that find its pool empty are answered with 503 Service Unavailable until a refill succeeds."""
+	def __init__(self, profiles=None, pool_size=16, jobs=None, cache_size=256, latency_samples=10000, max_failures=100, rng=None):
+		from collections import deque, OrderedDict
+		self.profiles = profiles or {"default": {}}
+		self.pool_size = pool_size
+		self.jobs = jobs or os.cpu_count() or 1
+		self.cache_size = cache_size
+		self.max_failures = max_failures
+		self.rng = get_rng(rng)
+		self.pools = {name: deque() for name in self.profiles}
+		self.cache = OrderedDict()
+		self.in_flight = {}
+		self.latencies = {"pool": deque(maxlen=latency_samples), "seed": deque(maxlen=latency_samples)}
+		self.counts = {"pool_hits": 0, "pool_misses": 0, "cache_hits": 0, "cache_misses": 0, "failures": 0}
+		self.executor = None
+		self.refill_events = {}
+		self.errors = {}
+	
+	async def generate(self, name, seed):
+		import asyncio
+		return await asyncio.get_running_loop().run_in_executor(self.executor, serve_record, self.profiles[name], seed)
+	
+	async def generate_valid(self, name):
+		"""Generates graphs from fresh seeds until one succeeds, raising a GraphError after max_failures failures in a row"""
+		for i in range(self.max_failures):
+			succeeded, data = await self.generate(name, str(self.rng.randrange(2**32)))
+			if succeeded: return data
+			self.counts["failures"] += 1
+		raise GraphError("Profile %s failed to generate a graph %s times in a row" % (name, self.max_failures))
+	
+	async def refill(self, name):
+		"""Keeps a profile's pool topped up, generating up to one graph per worker at a time"""
+		import asyncio
+		pool = self.pools[name]
+		event = self.refill_events[name]
+		while True:
+			try:
+				while len(pool) < self.pool_size:
+					batch = await asyncio.gather(*(self.generate_valid(name) for i in range(min(self.jobs, self.pool_size - len(pool)))), return_exceptions=True)
+					pool.extend([data for data in batch if not isinstance(data, BaseException)][:self.pool_size - len(pool)])
+					for error in batch:
+						if isinstance(error, BaseException): raise error
+				self.errors.pop(name, None)
+			except Exception as e:
+				logger.exception("Stopped refilling the %s pool", name)
+				self.errors[name] = str(e)
+			event.clear()
+			await event.wait()
+	
+	async def get_dungeon(self, name):
+		"""Returns an encoded graph from a profile's pool, or generates one if the pool is empty
+		
+		Raises a GraphError if the pool is empty because its last refill failed."""
+		pool = self.pools[name]
+		self.refill_events[name].set()
+		if pool:
+			self.counts["pool_hits"] += 1
+			return pool.popleft()
+		self.counts["pool_misses"] += 1
+		if name in self.errors: raise GraphError(self.errors[name])
+		return await self.generate_valid(name)
+	
+	async def get_seeded_dungeon(self, name, seed):
+		"""Returns whether the graph for a seed was generated and its encoded record, from the cache if possible
+		
+		Concurrent requests for the same seed share one generation."""
+		import asyncio
+		key = (name, seed)
+		if key in self.cache:
+			self.counts["cache_hits"] += 1
+			self.cache.move_to_end(key)
+			return self.cache[key]
+		self.counts["cache_misses"] += 1
+		if key not in self.in_flight:
+			self.in_flight[key] = asyncio.ensure_future(self.generate(name, seed))
+		try:
+			result = await asyncio.shield(self.in_flight[key])
+		finally:
+			if key in self.in_flight and self.in_flight[key].done(): del self.in_flight[key]
+		self.cache[key] = result
+		while len(self.cache) > self.cache_size: self.cache.popitem(last=False)
+		return result
+	
+	def metrics(self):
+		"""Returns a dict of pool depths, hit and miss counts, and latency percentiles in milliseconds"""
+		latencies = {}
+		for kind, samples in self.latencies.items():
+			samples = sorted(samples)
+			latencies[kind] = {
+				"count": len(samples),
+				"p50": samples[len(samples)//2]*1000 if samples else None,
+				"p99": samples[min(len(samples) - 1, int(0.99*len(samples)))]*1000 if samples else None
+			}
+		return {"pools": {name: len(pool) for name, pool in self.pools.items()}, "cache": len(self.cache), "counts": dict(self.counts), "errors": dict(self.errors), "latency": latencies}
+	
+	async def respond(self, target):
+		"""Returns the status and JSON body for a request target"""
+		import json
+		from urllib.parse import urlsplit, parse_qs
+		url = urlsplit(target)
+		query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+		if url.path == "/metrics":
+			return 200, json.dumps(self.metrics()).encode()
+		if url.path != "/dungeon":
+			return 404, json.dumps({"error": "Unknown path %s" % url.path}).encode()
+		name = query.get("profile", next(iter(self.profiles)))
+		if name not in self.profiles:
+			return 400, json.dumps({"error": "Unknown profile %s" % name}).encode()
+		start = time.perf_counter()
+		if "seed" in query:
+			succeeded, data = await self.get_seeded_dungeon(name, query["seed"])
+			self.latencies["seed"].append(time.perf_counter() - start)
+			return 200 if succeeded else 422, data
+		try:
+			data = await self.get_dungeon(name)
+		except GraphError as e:
+			logger.warning("Could not serve a dungeon from the %s pool: %s", name, e)
+			return 503, json.dumps({"error": str(e)}).encode()
+		self.latencies["pool"].append(time.perf_counter() - start)
+		return 200, data
+	
+	async def handle(self, reader, writer):
+		"""Answers HTTP/1.1 GET requests on a connection until the client closes it"""
+		import json
+		reasons = {200: b"OK", 400: b"Bad Request", 404: b"Not Found", 405: b"Method Not Allowed", 422: b"Unprocessable Entity", 500: b"Internal Server Error", 503: b"Service Unavailable"}
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line: break
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if line in (b"\r\n", b"\n", b""): break
+					name, _, value = line.decode("latin-1").partition(":")
+					headers[name.strip().lower()] = value.strip()
+				if "content-length" in headers: await reader.readexactly(int(headers["content-length"]))
+				parts = request_line.decode("latin-1").split()
+				if len(parts) != 3:
+					status, body = 400, b"{}"
+				elif parts[0] != "GET":
+					status, body = 405, b"{}"
+				else:
+					try:
+						status, body = await self.respond(parts[1])
+					except Exception as e:
+						logger.exception("Failed to answer %s", parts[1])
+						status, body = 500, json.dumps({"error": str(e)}).encode()
+				keep_alive = len(parts) == 3 and parts[2] == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+				writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n" % (
+					status,
+					reasons[status],
+					len(body),
+					b"" if keep_alive else b"Connection: close\r\n"
+				))
+				writer.write(body)
+				await writer.drain()
+				if not keep_alive: break
+		except (ConnectionError, ValueError) as e:
+			logger.info("Dropped connection: %s", e)
+		finally:
+			writer.close()
+	
+	async def serve(self, address="127.0.0.1:8000"):
+		"""Fills the pools and serves requests until cancelled
+		
+		address is either HOST:PORT (or just PORT) for HTTP over TCP, or the path of a Unix socket."""
+		import asyncio
+		from concurrent.futures import ProcessPoolExecutor
+		self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+		self.refill_events = {name: asyncio.Event() for name in self.profiles}
+		refills = [asyncio.ensure_future(self.refill(name)) for name in self.profiles]
+		try:
+			if os.sep in address or address.endswith(".sock"):
+				server = await asyncio.start_unix_server(self.handle, path=address)
+			else:
+				host, _, port = address.rpartition(":")
+				server = await asyncio.start_server(self.handle, host or "127.0.0.1", int(port))
+			logger.info("Serving dungeons on %s", address)
+			async with server:
+				await server.serve_forever()
+		finally:
+			for refill in refills: refill.cancel()
+			self.executor.shutdown(wait=False, cancel_futures=True)
+	
+	def run(self, address="127.0.0.1:8000"):
+		"""Runs serve in a new event loop until interrupted"""
+		import asyncio
+		try:
+			asyncio.run(self.serve(address))
+		except KeyboardInterrupt:
+			pass
+
+def dump_graphs(graphs, output, binary=False):
+	"""Writes graphs (or GraphCores) to a path one at a time, returning how many were written
+	
+	Graphs are written as JSON Lines in the form returned by Graph.to_dict, or if binary is True, after a short header as
+	length-prefixed records in the form returned by GraphCore.to_bytes. An offset index is also written next to the
+	output so load_graph can read any one graph without parsing the rest."""
+	import json, struct
+	offsets = array("Q")
+	with open(output, "wb") as f:
+		if binary: f.write(BINARY_MAGIC + struct.pack("<H", FORMAT_VERSION))
+		for graph in graphs:
+			offsets.append(f.tell())
+			if binary:
+				data = (graph.compact() if isinstance(graph, Graph) else graph).to_bytes()
+				f.write(struct.pack("<I", len(data)))
+				f.write(data)
+			else:
+				data = graph.to_graph().to_dict() if isinstance(graph, GraphCore) else graph.to_dict()
+				f.write(json.dumps(data, separators=(",", ":")).encode() + b"\n")
+		offsets.append(f.tell())
+	write_offsets(output + ".index", offsets)
+	return len(offsets) - 1
+
+def load_graphs(path, compact=False):
+	"""Yields each graph in a file written by dump_graphs or generate_many, as a GraphCore if compact is True
+	
+	Records from generate_many that hold an error instead of a graph are skipped."""
+	with open(path, "rb") as f:
+		binary = read_header(f)
+		for offset, data in read_records(f, binary):
+			graph = decode_graph(data, binary, compact)
+			if graph is not None: yield graph
+
+def load_graph(path, position, compact=False):
+	"""Returns the graph at the given position in a file written by dump_graphs or generate_many
+	
+	If the file has an offset index (see write_index), only that graph is read; otherwise the records before it are
+	skipped over without being parsed. An index whose last offset isn't the file's size was written for an older version
+	of the file, and is ignored."""
+	import struct
+	with open(path, "rb") as f:
+		binary = read_header(f)
+		try:
+			with open(path + ".index", "rb") as index:
+				index.seek(-8, os.SEEK_END)
+				size, = struct.unpack("<Q", index.read(8))
+				if size != os.fstat(f.fileno()).st_size:
+					logger.warning("Ignoring the offset index for %s, which doesn't match the file", path)
+					raise OSError
+				index.seek(8*position)
+				start, end = struct.unpack("<QQ", index.read(16))
+		except (OSError, struct.error):
+			start = end = None
+		if start is not None:
+			f.seek(start)
+			data = f.read(end - start)
+			if binary: data = data[4:]
+		else:
+			for i, (start, data) in enumerate(read_records(f, binary)):
+				if i == position: break
+			else:
+				raise IndexError("%s has fewer than %s graphs" % (path, position + 1))
+	graph = decode_graph(data, binary, compact)
+	if graph is None: raise GraphError("Record %s in %s holds no graph" % (position, path))
+	return graph
+
+def unique_graphs(graphs, seen=None):
+	"""Yields each graph (or GraphCore) whose fingerprint isn't in the set seen, adding the fingerprints of those yielded"""
+	if seen is None: seen = set()
+	for graph in graphs:
+		fingerprint = graph.fingerprint()
+		if fingerprint in seen: continue
+		seen.add(fingerprint)
+		yield graph
+
+def deduplicate(path, output, binary=None):
+	"""Writes the graphs in a file written by dump_graphs or generate_many to output, dropping any graph that is
+	structurally the same as an earlier one (see GraphCore.fingerprint), and returns how many were kept and dropped
+	
+	Graphs are streamed one at a time, so only their fingerprints are kept in memory. The output is written with
+	dump_graphs, in the same format as the input unless binary is given."""
+	if binary is None:
+		with open(path, "rb") as f:
+			binary = read_header(f)
+	total = 0
+	def count(graphs):
+		nonlocal total
+		for graph in graphs:
+			total += 1
+			yield graph
+	kept = dump_graphs(unique_graphs(count(load_graphs(path, compact=True))), output, binary=binary)
+	return kept, total - kept
+
+def write_index(path):
+	"""Writes the offset index used by load_graph for a file written by dump_graphs or generate_many"""
+	offsets = array("Q")
+	with open(path, "rb") as f:
+		binary = read_header(f)
+		for offset, data in read_records(f, binary):
+			offsets.append(offset)
+		offsets.append(f.tell())
+	write_offsets(path + ".index", offsets)
+
+def write_offsets(path, offsets):
+	import sys
+	if sys.byteorder == "big": offsets.byteswap()
+	with open(path, "wb") as f:
+		offsets.tofile(f)
+
+def read_header(f):
+	"""Returns whether an open dump file is binary, leaving it positioned at its first record"""
+	import struct
+	header = f.read(len(BINARY_MAGIC) + 2)
+	if header[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+		f.seek(0)
+		return False
+	version, = struct.unpack("<H", header[len(BINARY_MAGIC):])
+	if version > FORMAT_VERSION:
+		raise GraphError("Graph file is version %s, but only versions up to %s are supported." % (version, FORMAT_VERSION))
+	return True
+
+def read_records(f, binary):
+	"""Yields the offset and undecoded data of each record in an open dump file"""
+	import struct
+	while True:
+		offset = f.tell()
+		if binary:
+			length = f.read(4)
+			if not length: return
+			data = f.read(struct.unpack("<I", length)[0])
+		else:
+			data = f.readline()
+			if not data: return
+			if not data.strip(): continue
+		yield offset, data
+
+def decode_graph(data, binary, compact=False):
+	import json
+	if binary:
+		core = GraphCore.from_bytes(data)
+		return core if compact else core.to_graph()
+	data = json.loads(data)
+	if "nodes" not in data:
+		# a generate_many record
+		if "graph" not in data: return None
+		data = data["graph"]
+	graph = Graph.from_dict(data)
+	return graph.compact() if compact else graph
+
+class GraphCache():
+	"""Persistent cache of generated graphs in a directory, keyed by a hash of their seed, parameters, and GENERATOR_VERSION
+	
+	Graphs are stored in the binary dump format, one per file, and read back through a memory map, so a hit costs a file
+	map and a decode instead of a generation. Files are written to a temporary name and renamed into place, so several
+	processes can share a directory. Once the directory holds more than max_bytes, the least recently used files are
+	removed; hits update a file's modification time, so eviction is by last use across every process."""
+	SUFFIX = ".dspn"
+	
+	def __init__(self, directory, max_bytes=256*2**20):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.size = None
+		os.makedirs(directory, exist_ok=True)
+	
+	@staticmethod
+	def normalize_parameters(params):
+		"""Returns random_graph arguments with defaults filled in and numbers as floats, so equal arguments hash the same"""
+		import inspect
+		defaults = {name: parameter.default for name, parameter in inspect.signature(Graph.random_graph).parameters.items() if name not in ("rng", "stats")}
+		for name in params:
+			if name not in defaults: raise TypeError("random_graph() got an unexpected keyword argument '%s'" % name)
+		normalized = dict(defaults, **params)
+		return {name: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value for name, value in normalized.items()}
+	
+	def get_key(self, seed, params, kind="random_graph"):
+		"""Returns the hex digest that a graph is stored under"""
+		import hashlib, json
+		data = {"kind": kind, "seed": seed, "params": self.normalize_parameters(params), "generator": GENERATOR_VERSION, "format": FORMAT_VERSION}
+		return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+	
+	def get_path(self, key):
+		return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+	
+	def get(self, key, compact=False):
+		"""Returns the graph stored under key (as a GraphCore if compact is True), or None if it isn't cached"""
+		import mmap, struct
+		path = self.get_path(key)
+		try:
+			with open(path, "rb") as f:
+				binary = read_header(f)
+				start = f.tell()
+				with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+					view = memoryview(data)
+					try:
+						core = GraphCore.from_bytes(view[start:]) if binary else None
+					except (ValueError, struct.error):
+						core = None # left truncated by something other than put
+					finally:
+						view.release()
+			os.utime(path)
+		except (OSError, ValueError):
+			return None
+		if core is None: return None
+		return core if compact else core.to_graph()
+	
+	def put(self, key, graph):
+		"""Stores a graph (or GraphCore) under key, then evicts old graphs if the cache is over max_bytes"""
+		import struct, tempfile
+		core = graph.compact() if isinstance(graph, Graph) else graph
+		data = BINARY_MAGIC + struct.pack("<H", FORMAT_VERSION) + core.to_bytes()
+		path = self.get_path(key)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+		try:
+			with os.fdopen(descriptor, "wb") as f:
+				f.write(data)
+			os.replace(temporary_path, path)
+		except BaseException:
+			os.remove(temporary_path)
+			raise
+		if self.size is None: self.size = self.get_size()
+		else: self.size += len(data)
+		if self.size > self.max_bytes: self.evict()
+	
+	def get_entries(self):
+		"""Returns the path, size, and modification time of every cached graph"""
+		entries = []
+		for directory in os.scandir(self.directory):
+			if not directory.is_dir(): continue
+			for entry in os.scandir(directory.path):
+				if not entry.name.endswith(self.SUFFIX): continue
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue
+				entries.append((entry.path, stat.st_size, stat.st_mtime))
+		return entries
+	
+	def get_size(self):
+		return sum(size for path, size, mtime in self.get_entries())
+	
+	def evict(self):
+		"""Removes the least recently used graphs until the cache fits in max_bytes"""
+		entries = sorted(self.get_entries(), key=lambda entry: entry[2])
+		self.size = sum(size for path, size, mtime in entries)
+		for path, size, mtime in entries:
+			if self.size <= self.max_bytes: break
+			try:
+				os.remove(path)
+			except OSError:
+				pass # removed by another process
+			self.size -= size
+		logger.info("Evicted graphs from %s down to %s bytes", self.directory, self.size)
+	
+	def clear(self):
+		for path, size, mtime in self.get_entries():
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		self.size = 0
+	
+	def random_graph(self, seed, compact=False, **params):
+		"""Returns Graph.random_graph(rng=random.Random(seed), **params), from the cache if possible"""
+		if seed is None: raise ValueError("Only seeded graphs can be cached.")
+		key = self.get_key(seed, params)
+		graph = self.get(key, compact)
+		if graph is None:
+			graph = Graph.random_graph(rng=random.Random(seed), **params)
+			self.put(key, graph)
+			if compact: graph = graph.compact()
+		return graph
+	
+	def example_graph(self, seed):
+		"""Returns example_graph(random.Random(seed)), names included, from the cache if possible"""
+		if seed is None: raise ValueError("Only seeded graphs can be cached.")
+		key = self.get_key(seed, {}, kind="example_graph")
+		graph = self.get(key)
+		if graph is None:
+			graph = example_graph(random.Random(seed))
+			self.put(key, graph)
+		return graph
+
+def example_graph(rng=None):
 	# Return an example graph with uniquely named rooms, passages, and keys
+	graph = Graph.random_graph(node_count=20, key_count=8, max_links_per_node=4, loopback_chance_from_none=0.2, loopback_chance_from_region=0.4, region_chance_from_region=0, regions_can_connect=False, avoid_redundant_links=True, rng=rng)
+	name_example_graph(graph)
+	return graph
+
+def name_example_graph(graph, room_names=None, path_names=None, key_names=None):
+	# Give the graph's rooms, passages, and keys unique names, drawn from NameAllocators that default to the built-in
+	# vocabulary
 	node_descriptor_1 = [
 		"big",
 		"cavernous",
@@ -521,7 +2907,7 @@ def example_graph():
 		"sunlit",
 		"windy"
 	]
-	key_names = [
+	key_descriptor = [
 		"a day when you feel better",
 		"all manner of deviltry",
 		"whispers from the storefronts",
@@ -549,44 +2935,238 @@ def example_graph():
 		"one good thing to say"
 	]
 	
-	# Make graph
-	graph = Graph.random_graph(node_count=20, key_count=8, max_links_per_node=4, loopback_chance_from_none=0.2, loopback_chance_from_region=0.4, region_chance_from_region=0, regions_can_connect=False, avoid_redundant_links=True)
-	assert len(node_descriptor_1)*len(node_descriptor_2) >= len(graph.nodes)
-	assert len(link_descriptor_1)*len(link_descriptor_2) >= len(graph.links)
-	assert len(key_names) >= len(graph.keys)
+	if room_names is None: room_names = NameAllocator("a %s, %s room", (node_descriptor_1, node_descriptor_2), rng=graph.rng)
+	if path_names is None: path_names = NameAllocator("the %s, %s path", (link_descriptor_1, link_descriptor_2), rng=graph.rng)
+	if key_names is None: key_names = NameAllocator("%s", (key_descriptor,), rng=graph.rng)
 	
 	# Name graph elements
-	random.shuffle(key_names)
 	for key in graph.keys:
-		key.id = Colors.KEY + key_names.pop() + Colors.END
-	used_node_names = []
+		key.id = Colors.KEY + key_names.next() + Colors.END
 	for node in graph.nodes:
-		while True:
-			name = "a %s, %s room" % (random.choice(node_descriptor_1), random.choice(node_descriptor_2))
-			if name not in used_node_names:
-				used_node_names.append(name)
-				node.id = Colors.ROOM + name + Colors.END
-				break
-	used_link_names = []
+		node.id = Colors.ROOM + room_names.next() + Colors.END
 	for link in graph.links:
-		while True:
-			name = "the %s, %s path" % (random.choice(link_descriptor_1), random.choice(link_descriptor_2))
-			if name not in used_link_names:
-				used_link_names.append(name)
-				link.id = Colors.PATH + name + Colors.END
-				break
+		link.id = Colors.PATH + path_names.next() + Colors.END
 	return graph
 
+class LazyDungeon(Graph):
+	"""An unbounded dungeon for adventure that only generates regions when they are first reached
+	
+	The dungeon is an endless tree of regions, each built like a region of Graph.random_graph_by_region from its own seed
+	(derived from its parent's), with its own region keys and names from name_example_graph. Regions that haven't been
+	generated are stood in for by placeholder nodes at the far end of the links into them, and reach() generates a
+	placeholder's region before returning the real node. Each link into a child region may be locked by a gate key
+	placed in its parent region, so the dungeon stays solvable across region boundaries. Once more than max_regions are
+	generated, the least recently reached region without a visitor in it is evicted, leaving placeholders behind, and
+	is generated again from its seed when it is next reached. Key items are kept across evictions, so keys that have been
+	collected still open the regenerated locks. Graph methods that sweep from the start node, like validate, only
+	describe the dungeon until something is evicted."""
+	def __init__(self,
+		seed=None,
+		region_size=(10, 20), # range of the number of nodes in each region
+		branches=(1, 3), # range of the number of regions branching off of each region
+		keys_per_region=(1, 3), # range of the number of region keys in each region
+		gate_chance=0.5, # chance that the link into a child region is locked by a key placed in its parent region
+		max_links_per_node=4,
+		loopback_chance_from_region=0.3,
+		priority_for_low_link_nodes=1,
+		avoid_redundant_links=True,
+		max_regions=8, # number of regions kept generated before the least recently reached ones are evicted
+		rng=None # random.Random used by adventure for the wanderer (defaults to one seeded from seed)
+	):
+		if seed is None: seed = random.randrange(2**32)
+		super().__init__(rng=rng or random.Random(seed))
+		self.free_links = None # locks are only placed while building regions
+		self.region_size = region_size
+		self.branches = branches
+		self.keys_per_region = keys_per_region
+		self.gate_chance = gate_chance
+		self.region_params = dict(
+			max_links_per_node=max_links_per_node,
+			loopback_chance_from_region=loopback_chance_from_region,
+			priority_for_low_link_nodes=priority_for_low_link_nodes,
+			avoid_redundant_links=avoid_redundant_links,
+			max_attempts=5,
+			max_key_retries=10
+		)
+		self.max_regions = max_regions
+		# every region discovered so far: its seed, its parent's and children's region numbers, its key items, the name and
+		# gate key of the link into it, and its nodes and links while it is generated
+		self.regions = {1: {"seed": seed, "parent": None, "children": None, "keys": None, "entry_name": None, "entry_key": None, "nodes": None, "links": None, "reached": 0}}
+		self.generated_regions = set()
+		# the link into each region other than the first, while either end of it is generated
+		self.entry_links = {}
+		# placeholder nodes and the regions they stand in for
+		self.placeholders = {}
+		self.visitors = {}
+		self.reach_count = 0
+		# called with the nodes and links removed by each eviction, so callers can forget them
+		self.on_evict = None
+		self.generate_region(1)
+		self.set_start_node(self.regions[1]["nodes"][0])
+	
+	def build_region(self, region):
+		"""Returns the named single-region graph for a region, the same every time"""
+		record = self.regions[region]
+		rng = random.Random(record["seed"])
+		size = rng.randint(*self.region_size)
+		key_count = min(rng.randint(*self.keys_per_region), size - 1)
+		port_count = rng.randint(*self.branches)
+		graph, unplaced = build_region(region, size, port_count, KEY_NAMES[:key_count], self.region_params, rng)
+		# gate the links to the stubs standing in for child regions with keys placed in this region
+		for link in graph.links[1:]:
+			if link.connected_nodes[1].region is not None: continue
+			if rng.random() < self.gate_chance:
+				node_options = [n for n in graph.nodes if n.region is not None and len(n.key_items) < n.max_key_items]
+				if not node_options: continue
+				key_item = KeyItem("gate")
+				rng.choice(node_options).add_key_item(key_item)
+				link.add_required_key(key_item)
+				graph.keys.append(key_item)
+		name_example_graph(graph)
+		return graph
+	
+	def generate_region(self, region):
+		"""Adds a region's nodes, links, and keys to the graph, replacing any placeholders for it"""
+		logger.info("Generating region %s", region)
+		record = self.regions[region]
+		graph = self.build_region(region)
+		if record["keys"] is None: record["keys"] = [KeyItem(k.id, region=k.region) for k in graph.keys]
+		keys = dict(zip(graph.keys, record["keys"]))
+		nodes = {}
+		for node in graph.nodes:
+			if node.region is None: continue
+			nodes[node] = self.add_node(node_id=node.id, region=region)
+		record["nodes"] = list(nodes.values())
+		self.generated_regions.add(region)
+		record["links"] = []
+		ports = []
+		for link in graph.links[1:]:
+			node1, node2 = link.connected_nodes
+			if node2 not in nodes:
+				ports.append((nodes[node1], link))
+				continue
+			new_link = self.link_nodes(nodes[node1], nodes[node2], [keys[k] for k in link.required_keys])
+			new_link.id = link.id
+			record["links"].append(new_link)
+		for key_item in graph.keys:
+			if key_item.location: nodes[key_item.location].add_key_item(keys[key_item])
+		if record["children"] is None:
+			record["children"] = []
+			for i, (node, link) in enumerate(ports):
+				child = len(self.regions) + 1
+				self.regions[child] = {
+					"seed": random.Random("%s/%s" % (record["seed"], i)).getrandbits(64),
+					"parent": region,
+					"children": None,
+					"keys": None,
+					"entry_name": link.id,
+					"entry_key": keys[link.required_keys[0]] if link.required_keys else None,
+					"nodes": None,
+					"links": None,
+					"reached": 0
+				}
+				record["children"].append(child)
+		# connect the entry links to this region and the regions branching off of it, using placeholders for the far ends
+		# of any that aren't generated
+		if region != 1: self.connect_entry(region, record["nodes"][0], 1)
+		for child, (node, link) in zip(record["children"], ports):
+			self.connect_entry(child, node, 0)
+	
+	def connect_entry(self, region, node, end):
+		"""Attaches a node at one end (0 for the parent, 1 for the child) of the link into a region"""
+		link = self.entry_links.get(region)
+		if link is None:
+			record = self.regions[region]
+			other_region = region if end == 0 else record["parent"]
+			placeholder = self.add_node(node_id="an unexplored room", region=other_region)
+			self.placeholders[placeholder] = other_region
+			ends = (node, placeholder) if end == 0 else (placeholder, node)
+			link = self.link_nodes(*ends, required_keys=[record["entry_key"]] if record["entry_key"] else None)
+			link.id = record["entry_name"]
+			self.entry_links[region] = link
+			return
+		placeholder = link.connected_nodes[end]
+		link.connected_nodes = (node, link.connected_nodes[1]) if end == 0 else (link.connected_nodes[0], node)
+		other_node = link.connected_nodes[1 - end]
+		node.links.append(link)
+		node.neighbors.add(other_node)
+		other_node.neighbors.discard(placeholder)
+		other_node.neighbors.add(node)
+		del self.placeholders[placeholder]
+		self.remove_elements([placeholder], [])
+	
+	def reach(self, node, visitor=None):
+		"""Returns the node a visitor has reached, generating its region first if it is a placeholder
+		
+		A visitor's region is never evicted while they are in it."""
+		if node in self.placeholders:
+			link = node.links[0]
+			end = link.connected_nodes.index(node)
+			self.generate_region(self.placeholders[node])
+			node = link.connected_nodes[end]
+		self.reach_count += 1
+		self.regions[node.region]["reached"] = self.reach_count
+		if visitor is not None: self.visitors[visitor] = node.region
+		if len(self.generated_regions) > self.max_regions:
+			candidates = [region for region in self.generated_regions if region not in self.visitors.values() and region != node.region]
+			if candidates: self.evict_region(min(candidates, key=lambda region: self.regions[region]["reached"]))
+		return node
+	
+	def evict_region(self, region):
+		"""Removes a generated region, leaving placeholders at the ends of the links into and out of it that still lead
+		somewhere generated"""
+		logger.info("Evicting region %s", region)
+		record = self.regions[region]
+		removed_nodes = list(record["nodes"])
+		removed_links = list(record["links"])
+		entries = [(child, 0) for child in record["children"]]
+		if region != 1: entries.append((region, 1))
+		for entry, end in entries:
+			link = self.entry_links[entry]
+			node, other_node = link.connected_nodes[end], link.connected_nodes[1 - end]
+			if other_node in self.placeholders:
+				# neither end is generated any more
+				del self.placeholders[other_node]
+				del self.entry_links[entry]
+				removed_nodes.append(other_node)
+				removed_links.append(link)
+				continue
+			placeholder = self.add_node(node_id=node.id, region=region)
+			self.placeholders[placeholder] = region
+			placeholder.links.append(link)
+			placeholder.neighbors.add(other_node)
+			link.connected_nodes = (placeholder, other_node) if end == 0 else (other_node, placeholder)
+			other_node.neighbors.discard(node)
+			other_node.neighbors.add(placeholder)
+		for key_item in record["keys"]:
+			key_item.location = None
+		record["nodes"] = record["links"] = None
+		self.generated_regions.discard(region)
+		self.remove_elements(removed_nodes, removed_links)
+		if self.on_evict: self.on_evict(removed_nodes, removed_links)
+	
+	def remove_elements(self, nodes, links):
+		nodes = set(nodes)
+		links = set(links)
+		self.nodes = [n for n in self.nodes if n not in nodes]
+		self.links = [l for l in self.links if l not in links]
+		for i, node in enumerate(self.nodes):
+			node.index = i
+		for i, link in enumerate(self.links):
+			link.index = i
+
 def adventure(graph):
-	# Do a text-adventure-style crawl through the specified graph
+	# Do a text-adventure-style crawl through the specified graph, which may be a LazyDungeon
+	rng = graph.rng
+	lazy = isinstance(graph, LazyDungeon)
 	
 	current_node = graph.start_node
-	visited_nodes = []
-	visited_links = []
-	attempted_links = []
-	inventory = []
+	visited_nodes = set()
+	visited_links = set()
+	attempted_links = set()
+	inventory = set()
 	wanderer_node = graph.start_node
-	wanderer_inventory = []
+	wanderer_inventory = set()
 	wanderer_cooldown = 3
 	wanderer_actions = [
 		"gives you an unsettling look",
@@ -599,16 +3179,23 @@ def adventure(graph):
 		"gives you a blessing",
 		"smiles warmly at you"
 	]
-	random.shuffle(wanderer_actions)
+	rng.shuffle(wanderer_actions)
+	if lazy:
+		def forget(nodes, links):
+			# evicted rooms and paths are generated again as new objects
+			visited_nodes.difference_update(nodes)
+			visited_links.difference_update(links)
+			attempted_links.difference_update(links)
+		graph.on_evict = forget
 	line = "-------------------------------------------------------------------------------"
 	
 	while True:
 		print(line)
 		print("> You find yourself in %s" % (current_node.id))
-		if current_node not in visited_nodes: visited_nodes.append(current_node)
+		visited_nodes.add(current_node)
 		if len(current_node.key_items) > 0 and current_node.key_items[0] not in inventory:
 			print("> In this room, you find %s" % (current_node.key_items[0]))
-			inventory.append(current_node.key_items[0])
+			inventory.add(current_node.key_items[0])
 		if len(visited_nodes) >= len(graph.nodes):
 			print("> You have seen all that there is to see.")
 			response = get_user_options(["Yes", "No"], "> Continue exploring?")
@@ -624,13 +3211,15 @@ def adventure(graph):
 		print(line)
 		if len(selected_link.required_keys) > 0 and selected_link.required_keys[0] not in inventory:
 			print("> You cannot travel this path until you have found %s" % (selected_link.required_keys[0]))
-			if selected_link not in attempted_links: attempted_links.append(selected_link)
+			attempted_links.add(selected_link)
 		else:
 			if len(selected_link.required_keys) > 0:
 				print("> Travelling this path requires %s, which you have found" % (selected_link.required_keys[0]))
-			print("> You travel down %s and reach %s" % (selected_link, selected_link.get_destination_node(current_node)))
-			current_node = selected_link.get_destination_node(current_node)
-			if selected_link not in visited_links: visited_links.append(selected_link)
+			next_node = selected_link.get_destination_node(current_node)
+			if lazy: next_node = graph.reach(next_node, "player")
+			print("> You travel down %s and reach %s" % (selected_link, next_node))
+			current_node = next_node
+			visited_links.add(selected_link)
 			# wanderer
 			if len(wanderer_actions) > 0:
 				if wanderer_cooldown <= 0:
@@ -642,9 +3231,10 @@ def adventure(graph):
 				else:
 					wanderer_cooldown -= 1
 				if len(wanderer_node.key_items) > 0 and wanderer_node.key_items[0] not in wanderer_inventory:
-					wanderer_inventory.append(wanderer_node.key_items[0])
-				selected_link = random.choice([l for l in wanderer_node.links if len(l.required_keys)==0 or l.required_keys[0] in wanderer_inventory])
+					wanderer_inventory.add(wanderer_node.key_items[0])
+				selected_link = rng.choice([l for l in wanderer_node.links if len(l.required_keys)==0 or l.required_keys[0] in wanderer_inventory])
 				wanderer_node = selected_link.get_destination_node(wanderer_node)
+				if lazy: wanderer_node = graph.reach(wanderer_node, "wanderer")
 
 def get_user_options(options, prompt="Select from the following:", return_index=False):
 	while True:
@@ -723,17 +3313,195 @@ def test():
 		
 
 
+def benchmark_import(repeat=20):
+	"""Returns the median number of seconds that importing this module adds to starting a fresh Python process"""
+	import subprocess, sys, time, statistics, tempfile
+	directory, filename = os.path.split(os.path.abspath(__file__))
+	env = dict(os.environ, PYTHONPATH=directory)
+	def time_process(code):
+		times = []
+		for i in range(repeat):
+			start = time.perf_counter()
+			subprocess.run([sys.executable, "-c", code], cwd=tempfile.gettempdir(), env=env, check=True)
+			times.append(time.perf_counter() - start)
+		return statistics.median(times)
+	return time_process("import %s" % os.path.splitext(filename)[0]) - time_process("pass")
+
+BENCHMARK_PROFILES = {
+	"default": {},
+	"high_loopback": dict(max_links_per_node=4, loopback_chance_from_none=0.3, loopback_chance_from_region=0.4),
+	"many_regions": dict(region_chance_from_none=0.8, region_chance_from_region=0.3, regions_can_connect=True),
+	"low_link_priority": dict(priority_for_low_link_nodes=5)
+}
+
+def benchmark(node_counts=(30, 100, 1000, 10000), profiles=None, repeat=3, seed=0, layout_iterations=20, pure_python_layout_limit=300, output=None):
+	"""Times generation, reachability, layout, and naming with fixed seeds, returning a JSON-friendly dict of results
+	
+	Graph.random_graph is timed under each of the named BENCHMARK_PROFILES (all of them by default) at each node count,
+	with keys and extra locks scaled to the graph's size. Graph.get_available_nodes, Graph.validate, and
+	layout_iterations steps of ForceLayout are timed on each default-profile graph (skipping graphs of more than
+	pure_python_layout_limit nodes if NumPy isn't installed), followed by name_example_graph, and the import time is
+	measured once. Every case is run repeat times and keeps each time along with the median. If output is given, the
+	results are also written to it as JSON so they can be compared with compare_benchmarks."""
+	import json, platform, statistics, subprocess
+	if profiles is None: profiles = list(BENCHMARK_PROFILES)
+	try:
+		import numpy
+	except ImportError:
+		numpy = None
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+	except OSError:
+		commit = None
+	results = []
+	def run_case(name, function, **info):
+		case = dict(name=name, **info)
+		times = []
+		try:
+			for i in range(repeat):
+				start = time.perf_counter()
+				function()
+				times.append(time.perf_counter() - start)
+		except GraphError as e:
+			case["error"] = str(e)
+		case["times"] = times
+		case["median"] = statistics.median(times) if times else None
+		logger.info("Benchmarked %s: %s", name, case)
+		results.append(case)
+	
+	for node_count in node_counts:
+		params = dict(node_count=node_count, key_count=min(len(KEY_NAMES), node_count//3), extra_locks_for_global_keys=min(len(KEY_NAMES), node_count//3))
+		for profile in profiles:
+			profile_params = dict(params, **BENCHMARK_PROFILES[profile])
+			run_case("random_graph", lambda: Graph.random_graph(rng=random.Random(seed), **profile_params), profile=profile, node_count=node_count)
+		try:
+			graph = Graph.random_graph(rng=random.Random(seed), **params)
+		except GraphError as e:
+			logger.warning("Could not generate a %s node graph to benchmark: %s", node_count, e)
+			continue
+		run_case("get_available_nodes", graph.get_available_nodes, node_count=node_count)
+		run_case("validate", graph.validate, node_count=node_count)
+		if numpy or node_count <= pure_python_layout_limit:
+			run_case("layout", lambda: ForceLayout(graph, rng=random.Random(seed)).run(max_tries=0, max_iterations=layout_iterations), node_count=node_count, iterations=layout_iterations)
+		run_case("name_example_graph", lambda: name_example_graph(graph), node_count=node_count)
+	results.append({"name": "import", "median": benchmark_import()})
+	
+	report = {
+		"commit": commit,
+		"python": platform.python_version(),
+		"numpy": numpy.__version__ if numpy else None,
+		"seed": seed,
+		"repeat": repeat,
+		"results": results
+	}
+	if output is not None:
+		with open(output, "w") as f:
+			json.dump(report, f, indent="\t")
+	return report
+
+def benchmark_scaling(node_counts=(12500, 25000, 50000, 100000), profiles=None, key_count=0, repeat=3, seed=0, max_exponent=1.3):
+	"""Times Graph.random_graph at growing node counts, returning a line for each case with the growth from the last one
+
+	The growth is given as the exponent k in time ~ node_count^k between each count and the one before it, so near-linear
+	generation shows exponents close to 1 (a little above it from the O(log n) index updates), where a quadratic step
+	would show exponents close to 2. Cases above max_exponent are marked, as are profiles that fail to generate. Keys are
+	left out by default since each one adds a reachability pass over the whole graph, which is linear but much slower
+	than the topology loop. Like timeit, garbage collection is turned off while timing, since its pauses grow with
+	everything the process has allocated and would hide the growth of generation itself."""
+	import gc, math, statistics
+	if profiles is None: profiles = list(BENCHMARK_PROFILES)
+	lines = []
+	for profile in profiles:
+		last = None
+		for node_count in node_counts:
+			params = dict(BENCHMARK_PROFILES[profile], node_count=node_count, key_count=key_count, extra_locks_for_global_keys=key_count)
+			times = []
+			try:
+				for i in range(repeat):
+					gc.collect()
+					gc.disable()
+					try:
+						start = time.perf_counter()
+						Graph.random_graph(rng=random.Random(seed), **params)
+						times.append(time.perf_counter() - start)
+					finally:
+						gc.enable()
+			except GraphError as e:
+				lines.append("FAILED %s %s: %s" % (profile, node_count, e))
+				last = None
+				continue
+			median = statistics.median(times)
+			if last is None:
+				lines.append("%s %s: %.3fs" % (profile, node_count, median))
+			else:
+				exponent = math.log(median/last[1])/math.log(node_count/last[0])
+				lines.append("%s%s %s: %.3fs (x%.2f, n^%.2f)" % ("SUPERLINEAR " if exponent > max_exponent else "", profile, node_count, median, median/last[1], exponent))
+			logger.info("Benchmarked scaling: %s", lines[-1])
+			last = (node_count, median)
+	return lines
+
+def compare_benchmarks(baseline, report, tolerance=0.1):
+	"""Returns a line for each benchmark case in both reports, marking cases whose median grew by more than tolerance"""
+	def key(case):
+		return tuple((name, case[name]) for name in ("name", "profile", "node_count") if name in case)
+	baseline_medians = {key(case): case.get("median") for case in baseline["results"]}
+	lines = []
+	for case in report["results"]:
+		old, new = baseline_medians.get(key(case)), case.get("median")
+		if not old or new is None: continue
+		change = new/old - 1
+		lines.append("%s%s: %.4fs -> %.4fs (%+.1f%%)" % ("REGRESSION " if change > tolerance else "", " ".join(str(value) for name, value in key(case)), old, new, change*100))
+	return lines
+
 #############################################################################################
 
 if __name__ == "__main__":
 	import argparse
+	import sys
+	if os.name == "nt":
+		os.system("color") # enables terminal colors on Windows
+	logging.basicConfig(
+		level=logging.INFO,
+		format="%(levelname)s %(asctime)-15s %(filename)s:%(lineno)d:%(message)s",
+		filename="output.log",
+		filemode="w"
+	)
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--generate", help="Generate a dungeon graph and print its details.", action="store_true")
 	parser.add_argument("--draw", help="When using the --generate flag, show a rough graphical representation of the dungeon.", action="store_true")
+	parser.add_argument("--draw_output", "--draw-output", default=None, metavar="DIR", help="When using the --generate flag, write a graphical representation of each dungeon to the specified directory instead of showing it.")
+	parser.add_argument("--draw_format", default="png", choices=("png", "svg"), help="When using the --draw_output flag, specifies the image format to write. SVG output does not require PIL.")
+	parser.add_argument("--draw_max_size", type=int, default=4096, help="When using the --draw_output flag, specifies the maximum width or height of each image in pixels; larger drawings are scaled down.")
+	parser.add_argument("--load", default=None, metavar="FILE", help="Print the details of each dungeon in a file written with the --output flag.")
+	parser.add_argument("--load_position", type=int, default=None, help="When using the --load flag, only load the dungeon at the specified position (starting from 0), without reading the rest of the file.")
+	parser.add_argument("--dedup", default=None, metavar="FILE", help="When using the --load flag, write the dungeons to the specified file instead of printing them, dropping any dungeon with the same structure as an earlier one (ignoring names and region numbers).")
 	parser.add_argument("--adventure", help="Play through an adventure with an example dungeon.", action="store_true")
+	parser.add_argument("--lazy", action="store_true", help="When using the --adventure flag, explore an endless dungeon whose regions are only generated when they are first reached, keeping a few regions in memory at a time.")
 	parser.add_argument("--test", help="Run a test function.", action="store_true")
+	parser.add_argument("--benchmark_import", help="Measure how long importing dungeonspinner takes.", action="store_true")
+	parser.add_argument("--benchmark", help="Time graph generation, reachability, layout, and naming with fixed seeds and print the results.", action="store_true")
+	parser.add_argument("--benchmark_scaling", help="Time graph generation at 12500 to 100000 nodes and print how fast the time grows with the node count.", action="store_true")
+	parser.add_argument("--benchmark_sizes", type=int, nargs="+", default=[30, 100, 1000, 10000], metavar="NODE_COUNT", help="When using the --benchmark flag, specifies the node counts to benchmark.")
+	parser.add_argument("--benchmark_repeat", type=int, default=3, help="When using the --benchmark flag, specifies how many times each case is timed.")
+	parser.add_argument("--benchmark_baseline", default=None, metavar="FILE", help="When using the --benchmark flag, compare the results with a JSON file written by an earlier --benchmark --output run.")
 	
-	parser.add_argument("--seed", default=None, help="When using the --generate flag, specifies the seed used for random number generation.")
+	parser.add_argument("--seed", default=None, help="When using the --generate or --adventure flags, specifies the seed used for random number generation.")
+	parser.add_argument("--cache", default=None, metavar="DIR", help="When using the --generate or --adventure flags with a seed, reuse dungeons previously generated with the same seed and parameters from the specified directory, and save new ones there.")
+	parser.add_argument("--cache_size", type=int, default=256, help="When using the --cache flag, specifies the maximum size of the cache directory in megabytes. The least recently used dungeons are removed first.")
+	parser.add_argument("--stats", action="store_true", help="When using the --generate flag, print the time spent in each generation phase and counts of reachability sweeps, rejected and undone key and lock placements, and restarts.")
+	parser.add_argument("--analyze", action="store_true", help="When using the --generate or --load flags, print each dungeon's progression: the size of each sphere of rooms opened up by the keys found before it, each key's dependencies and unlock depth, and the length of a path that clears the dungeon. With the --output flag, the scores are also saved with each dungeon.")
+	parser.add_argument("--simulate", type=int, default=None, metavar="AGENTS", help="When using the --generate or --load flags, play through each dungeon headlessly with the specified number of random, wanderer, and greedy agents and print how long they took to clear it.")
+	parser.add_argument("--sweep", type=int, default=None, metavar="SETS", help="Generate dungeons from the specified number of random parameter sets and print each set's failure rate, generation time, and progression scores. Sets that clearly fail too often are stopped early.")
+	parser.add_argument("--sweep_seeds", type=int, default=20, help="When using the --sweep flag, specifies the number of seeds to try with each parameter set.")
+	parser.add_argument("--serve", default=None, metavar="ADDRESS", help="Serve dungeons as JSON over HTTP on the specified HOST:PORT or Unix socket path, from a pool of pre-generated dungeons. GET /dungeon takes a dungeon from the pool, GET /dungeon?seed=SEED generates (or returns the cached) dungeon for a seed, and GET /metrics reports pool depths and latencies.")
+	parser.add_argument("--serve_pool_size", type=int, default=16, help="When using the --serve flag, specifies the number of dungeons kept ready for each profile.")
+	parser.add_argument("--serve_profiles", default=None, metavar="FILE", help="When using the --serve flag, serve the profiles in the specified JSON file, which maps profile names to dicts of generation parameters, instead of a single default profile using the generation flags.")
+	parser.add_argument("--by_region", action="store_true", help="When using the --generate flag without the --output flag, build each region of a dungeon in parallel, using the number of worker processes given by the --jobs flag, then stitch them together and place the global keys and extra locks. Regions only meet the rest of the dungeon at their entry links.")
+	parser.add_argument("--jobs", type=int, default=1, help="When using the --generate, --sweep, or --serve flags, specifies the number of worker processes used to generate dungeons.")
+	parser.add_argument("--output", default=None, metavar="FILE", help="When using the --generate flag, write each dungeon to the specified file as a line of JSON instead of printing its details, along with an offset index for the --load_position flag. When using the --benchmark flag, write the results to the specified file as JSON.")
+	parser.add_argument("--format", default="text", choices=("text", "dot", "graphml"), help="When using the --generate or --load flags, specifies the format dungeons are printed in: text details, Graphviz DOT, or GraphML.")
+	parser.add_argument("--binary", action="store_true", help="When using the --output flag, write dungeons in a compact binary format instead of JSON.")
+	parser.add_argument("--count", type=int, default=1, help="When using the --generate flag, specifies the number of dungeons to generate. Each dungeon after the first uses the next integer seed.")
 	parser.add_argument("--node_count", type=int, default=30, help="When using the --generate flag, specifies the number of nodes in the final graph.")
 	parser.add_argument("--max_links_per_node", type=int, default=3, help="When using the --generate flag, specifies the maximum number of links a single node can have.")
 	parser.add_argument("--key_count", type=int, default=10, help="When using the --generate flag, specifies the number of key items to be placed in the graph.")
@@ -746,8 +3514,28 @@ if __name__ == "__main__":
 	parser.add_argument("--extra_locks_for_global_keys", type=int, default=10, help="When using the --generate flag, specifies the number of additional locks to place for non-regioned keys (i.e. when this value is greater than 0, at least one key will open multiple locks).")
 	parser.add_argument("--priority_for_low_link_nodes", type=float, default=1.0, help="When using the --generate flag, specifies the weight given to nodes with fewer links when selecting which node to branch from (i.e. when this value is higher, nodes with fewer links will be prioritized when adding new links).")
 	parser.add_argument("--avoid_redundant_links", action="store_true", help="When using the --generate flag, specifies if the generator should attempt to avoid linking two nodes that are already linked.")
+	parser.add_argument("--max_attempts", type=int, default=5, help="When using the --generate flag, specifies the number of times a new topology is built before giving up on a dungeon.")
+	parser.add_argument("--max_key_retries", type=int, default=10, help="When using the --generate flag, specifies the number of failed key placements allowed per topology. Each failure undoes the most recently placed key before trying again.")
+	parser.add_argument("--max_lock_retries", type=int, default=10, help="When using the --generate flag, specifies the number of failed extra lock placements allowed per topology. Each failure undoes the most recently placed extra lock before trying again.")
 	
 	args = parser.parse_args()
+	params = dict(
+		node_count = args.node_count,
+		max_links_per_node = args.max_links_per_node,
+		key_count = args.key_count,
+		loopback_chance_from_none = args.loopback_chance_from_none,
+		loopback_chance_from_region = args.loopback_chance_from_region,
+		regions_can_connect = args.regions_can_connect,
+		region_chance_from_none = args.region_chance_from_none,
+		region_chance_from_region = args.region_chance_from_region,
+		region_key_chance = args.region_key_chance,
+		extra_locks_for_global_keys = args.extra_locks_for_global_keys,
+		priority_for_low_link_nodes = args.priority_for_low_link_nodes,
+		avoid_redundant_links = args.avoid_redundant_links,
+		max_attempts = args.max_attempts,
+		max_key_retries = args.max_key_retries,
+		max_lock_retries = args.max_lock_retries
+	)
 	
 	if args.generate:
 		for arg in (
@@ -759,27 +3547,114 @@ if __name__ == "__main__":
 		):
 			if arg < 0 or arg > 1:
 				raise ValueError("Chance parameters must be between 0 and 1.")
-		random.seed(args.seed)
-		graph = Graph.random_graph(
-			node_count = args.node_count,
-			max_links_per_node = args.max_links_per_node,
-			key_count = args.key_count,
-			loopback_chance_from_none = args.loopback_chance_from_none,
-			loopback_chance_from_region = args.loopback_chance_from_region,
-			regions_can_connect = args.regions_can_connect,
-			region_chance_from_none = args.region_chance_from_none,
-			region_chance_from_region = args.region_chance_from_region,
-			region_key_chance = args.region_key_chance,
-			extra_locks_for_global_keys = args.extra_locks_for_global_keys,
-			priority_for_low_link_nodes = args.priority_for_low_link_nodes,
-			avoid_redundant_links = args.avoid_redundant_links
-		)
-		print(graph.details())
-		if args.draw:
-			graph.draw()
+		if args.count > 1:
+			if args.seed is None: args.seed = random.randrange(2**32)
+			seeds = [str(int(args.seed) + i) for i in range(args.count)]
+		else:
+			seeds = [args.seed]
+		if args.draw_output: os.makedirs(args.draw_output, exist_ok=True)
+		if (args.jobs > 1 and not args.by_region) or args.output:
+			failures = 0
+			cores = []
+			for record in generate_many(params, seeds, jobs=args.jobs, output=None if args.binary else args.output, stats=args.stats, analyze=args.analyze):
+				if args.stats:
+					stats = GenerationStats()
+					stats.attempts = record["stats"]["attempts"]
+					print("Seed %s:\n%s" % (record["seed"], stats))
+				if "error" in record:
+					failures += 1
+					print("Seed %s: %s" % (record["seed"], record["error"]))
+					continue
+				graph = Graph.from_dict(record["graph"])
+				if args.binary: cores.append(graph.compact())
+				if not args.output: graph.export(sys.stdout, format=args.format)
+				if args.analyze: print(graph.analyze_progression().details())
+				if args.simulate: print(PlaythroughSimulator(graph).details(args.simulate))
+				if args.draw_output:
+					path = os.path.join(args.draw_output, "dungeon_%s.%s" % (record["seed"], args.draw_format))
+					graph.render(path, format=args.draw_format, max_size=args.draw_max_size)
+					print("Wrote %s" % path)
+			if args.output:
+				if args.binary: dump_graphs(cores, args.output, binary=True)
+				print("Wrote %s dungeons to %s (%s failed)" % (len(seeds) - failures, args.output, failures))
+		else:
+			cache = GraphCache(args.cache, max_bytes=args.cache_size*2**20) if args.cache else None
+			for seed in seeds:
+				stats = GenerationStats() if args.stats else None
+				try:
+					if args.by_region: graph = Graph.random_graph_by_region(jobs=args.jobs, rng=random.Random(seed), stats=stats, **params)
+					elif cache and seed is not None and not stats: graph = cache.random_graph(seed, **params)
+					else: graph = Graph.random_graph(rng=random.Random(seed), stats=stats, **params)
+				finally:
+					if stats: print(stats)
+				graph.export(sys.stdout, format=args.format)
+				if args.analyze: print(graph.analyze_progression().details())
+				if args.simulate: print(PlaythroughSimulator(graph).details(args.simulate))
+				if args.draw_output:
+					path = os.path.join(args.draw_output, "dungeon_%s.%s" % (seed, args.draw_format))
+					graph.render(path, format=args.draw_format, max_size=args.draw_max_size)
+					print("Wrote %s" % path)
+				elif args.draw:
+					graph.draw()
+	elif args.load and args.dedup:
+		kept, dropped = deduplicate(args.load, args.dedup, binary=True if args.binary else None)
+		print("Wrote %s dungeons to %s (%s duplicates dropped)" % (kept, args.dedup, dropped))
+	elif args.load:
+		if args.load_position is not None:
+			graphs = [load_graph(args.load, args.load_position)]
+		else:
+			graphs = load_graphs(args.load)
+		for graph in graphs:
+			graph.export(sys.stdout, format=args.format)
+			if args.analyze: print(graph.analyze_progression().details())
+			if args.simulate: print(PlaythroughSimulator(graph).details(args.simulate))
+			if args.draw: graph.draw()
+	elif args.sweep:
+		parameter_sets = sample_parameters(args.sweep, rng=random.Random(args.seed))
+		def format_value(value):
+			if value is None: return "-"
+			return "%.1f" % value if isinstance(value, float) else str(value)
+		for summary in sweep(parameter_sets, seeds=args.sweep_seeds, jobs=args.jobs, output=args.output):
+			print("%s/%s failed%s, %.4fs mean, %s spheres, unlock depth %s, clear path %s: %s" % (
+				summary["failures"],
+				summary["seeds"],
+				" (stopped early)" if summary["stopped_early"] else "",
+				summary["time"]["mean"],
+				format_value(summary["quality"]["spheres"]),
+				format_value(summary["quality"]["max_unlock_depth"]),
+				format_value(summary["quality"]["clear_path_length"]),
+				", ".join("%s=%s" % (name, round(value, 3) if isinstance(value, float) else value) for name, value in summary["params"].items())
+			))
+	elif args.serve:
+		import json
+		if args.serve_profiles:
+			with open(args.serve_profiles) as f:
+				profiles = json.load(f)
+		else:
+			profiles = {"default": params}
+		print("Serving dungeons on %s" % args.serve)
+		DungeonServer(profiles, pool_size=args.serve_pool_size, jobs=args.jobs).run(args.serve)
 	elif args.adventure:
-		adventure(example_graph())
+		if args.lazy:
+			adventure(LazyDungeon(seed=args.seed))
+		elif args.cache and args.seed is not None:
+			adventure(GraphCache(args.cache, max_bytes=args.cache_size*2**20).example_graph(args.seed))
+		else:
+			adventure(example_graph(None if args.seed is None else random.Random(args.seed)))
 	elif args.test:
 		test()
+	elif args.benchmark_import:
+		print("Importing dungeonspinner takes %.1f ms" % (benchmark_import()*1000))
+	elif args.benchmark_scaling:
+		print("\n".join(benchmark_scaling()))
+	elif args.benchmark:
+		import json
+		report = benchmark(node_counts=args.benchmark_sizes, repeat=args.benchmark_repeat, output=args.output)
+		if args.benchmark_baseline:
+			with open(args.benchmark_baseline) as f:
+				print("\n".join(compare_benchmarks(json.load(f), report)))
+		else:
+			for case in report["results"]:
+				print("%s: %s" % (" ".join(str(case[name]) for name in ("name", "profile", "node_count") if name in case), case.get("error") or "%.4fs" % case["median"]))
 	else:
 		parser.print_help()
\ No newline at end of file